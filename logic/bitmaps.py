@@ -0,0 +1,164 @@
+import numpy as np
+
+# Number of set bits of every byte value
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+# Set of run positions in a store packed into one bit per run
+class Bitmap:
+    __slots__ = ("bits", "size")
+
+    def __init__(self, bits, size: int):
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(np.packbits(mask), len(mask))
+
+    @classmethod
+    def from_rows(cls, rows, size: int):
+        mask = np.zeros(size, dtype=bool)
+        mask[rows] = True
+        return cls.from_mask(mask)
+
+    @classmethod
+    def empty(cls, size: int):
+        return cls(np.zeros((size + 7) // 8, dtype=np.uint8), size)
+
+    @classmethod
+    def full(cls, size: int):
+        return cls.from_mask(np.ones(size, dtype=bool))
+
+    def _check(self, other):
+        if other.size != self.size:
+            raise ValueError("Bitmaps over different runs can't be combined.")
+
+    def __and__(self, other):
+        self._check(other)
+        return Bitmap(self.bits & other.bits, self.size)
+
+    def __or__(self, other):
+        self._check(other)
+        return Bitmap(self.bits | other.bits, self.size)
+
+    # Runs in this bitmap but not in the other one
+    def __sub__(self, other):
+        self._check(other)
+        return Bitmap(self.bits & ~other.bits, self.size)
+
+    def __invert__(self):
+        return Bitmap.full(self.size) - self
+
+    def count(self) -> int:
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def mask(self):
+        return np.unpackbits(self.bits, count=self.size).astype(bool)
+
+    def rows(self):
+        return np.flatnonzero(self.mask())
+
+
+# Bitmaps of the rows grouped by key, keys are in the order of their first row
+def _group_bitmaps(keys, rows, size) -> dict:
+    if len(keys) == 0:
+        return {}
+    order = np.argsort(keys, kind='stable')
+    ids, starts = np.unique(keys[order], return_index=True)
+    groups = np.split(rows[order], starts[1:])
+    bitmaps = {}
+    for position in np.argsort([group[0] for group in groups], kind='stable'):
+        bitmaps[int(ids[position])] = Bitmap.from_rows(groups[position], size)
+    return bitmaps
+
+
+# (pack id, run) of every pack a run of the store is in, in the order of currentPacks. A pack listed twice in a run counts
+# once and empty pack names are dropped, like in the packs feature. The packs come from the derived features when the
+# store has them.
+def pack_rows(store):
+    columns, field = (store.features, "packs") if store.features is not None else (store.columns, "currentPacks")
+    offsets = columns[f"{field}.offsets"]
+    keys = np.asarray(columns[f"{field}.values"], dtype=np.int64)
+    rows = np.repeat(np.arange(len(store)), np.diff(offsets))
+    if store.features is None:
+        kept = keys != store.interners["packs"].get("")
+        keys, rows = keys[kept], rows[kept]
+    _, first = np.unique(rows * max(len(store.interners["packs"]), 1) + keys, return_index=True)
+    first.sort()
+    return keys[first], rows[first]
+
+
+# Bitmap indexes over the runs of a RunStore for pack membership, victory, ascension level, hat and host.
+# Counting the runs that match some conditions is an AND of their bitmaps plus a popcount, the run records are never
+# rebuilt. The bitmaps of a dimension are built from the store columns the first time the dimension is used.
+# Runs without a field are in none of its bitmaps.
+class RunIndex:
+    def __init__(self, store):
+        self.store = store
+        self.size = len(store)
+        self._dimensions = {}
+        decided = store.field_mask("victory")
+        self.decided = Bitmap.from_mask(decided)
+        self.victory = Bitmap.from_mask(decided & (np.asarray(store.columns["victory"]) != 0))
+
+    def _pack_rows(self):
+        return pack_rows(self.store)
+
+    def _scalar_rows(self, field):
+        present = self.store.field_mask(field)
+        return np.asarray(self.store.columns[field], dtype=np.int64)[present], np.flatnonzero(present)
+
+    def _dimension(self, name) -> dict:
+        bitmaps = self._dimensions.get(name)
+        if bitmaps is None:
+            if name == "packs":
+                keys, rows = self._pack_rows()
+            else:
+                keys, rows = self._scalar_rows({"ascensions": "ascension_level", "hats": "pickedHat",
+                                                "hosts": "host"}[name])
+            bitmaps = self._dimensions[name] = _group_bitmaps(keys, rows, self.size)
+        return bitmaps
+
+    def _bitmap(self, name, key) -> Bitmap:
+        bitmap = self._dimension(name).get(key)
+        return bitmap if bitmap is not None else Bitmap.empty(self.size)
+
+    def _named(self, name, interner, value) -> Bitmap:
+        return self._bitmap(name, self.store.interners[interner].get(value))
+
+    def pack(self, pack: str) -> Bitmap:
+        return self._named("packs", "packs", pack)
+
+    def hat(self, hat: str) -> Bitmap:
+        return self._named("hats", "hats", hat)
+
+    def host(self, host: str) -> Bitmap:
+        return self._named("hosts", "hosts", host)
+
+    def ascension(self, level: int) -> Bitmap:
+        return self._bitmap("ascensions", level)
+
+    # {pack: bitmap} of every pack in the runs, in the order the packs first show up
+    def packs(self) -> dict:
+        names = self.store.interners["packs"].values
+        return {names[pack_id]: bitmap for pack_id, bitmap in self._dimension("packs").items()}
+
+    # Runs matching all given conditions, victory=False selects the lost runs (runs without a victory field are in
+    # neither)
+    def select(self, pack=None, ascension=None, victory=None, hat=None, host=None) -> Bitmap:
+        selected = Bitmap.full(self.size)
+        if pack is not None:
+            selected &= self.pack(pack)
+        if ascension is not None:
+            selected &= self.ascension(ascension)
+        if victory is not None:
+            selected &= self.victory if victory else self.decided - self.victory
+        if hat is not None:
+            selected &= self.hat(hat)
+        if host is not None:
+            selected &= self.host(host)
+        return selected
+
+    def count(self, **conditions) -> int:
+        return self.select(**conditions).count()
@@ -0,0 +1,331 @@
+import datetime
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from logic.storage import RunCache, RunSource, RunStore, keys_in_range
+
+
+# Copy of a state value that can be pickled, defaultdicts (whose factories often can't) become plain dicts
+def _plain(value):
+    if isinstance(value, defaultdict) or type(value) is dict:
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+# Adds the counts of source to target key by key: numbers are added, lists concatenated and nested dicts merged.
+# Keys new to target are appended in the order of source, so merging partials in date order keeps the order the keys
+# would have had in a single pass.
+def merge_counts(target: dict, source: dict):
+    for key, value in source.items():
+        if key not in target:
+            target[key] = value
+        elif isinstance(value, dict):
+            merge_counts(target[key], value)
+        elif isinstance(value, list):
+            target[key].extend(value)
+        else:
+            target[key] += value
+
+
+# Collects something from the runs. update is called once for every run, unless the accumulator is columnar and the
+# runs come from a RunStore, then update_shard gets the whole store and can work on its numpy columns.
+# The partial state of an accumulator can be saved, merged with the state of other runs and finalized later, which
+# lets the state of every partition be computed once and reused (see run_cached_insights).
+class Accumulator:
+    columnar = False
+    # Attributes that make up the partial state, the default state and merge handle numbers, lists and (nested) dicts
+    state_fields = ()
+    # Bump when update changes, saved partials of other versions are recomputed
+    version = 1
+
+    def update(self, run: dict):
+        pass
+
+    def update_shard(self, store: RunStore):
+        for run in store:
+            self.update(run)
+
+    # Empty accumulator with the same configuration
+    def fresh(self):
+        return type(self)()
+
+    # Name the partial state is saved under
+    @property
+    def partial_name(self) -> str:
+        return f"{type(self).__name__}.v{self.version}"
+
+    @property
+    def has_state(self) -> bool:
+        return bool(self.state_fields) or type(self).state is not Accumulator.state
+
+    def state(self) -> dict:
+        return {name: _plain(getattr(self, name)) for name in self.state_fields}
+
+    # Adds a state to this accumulator, states have to be merged in the order of the runs they were computed from
+    def merge(self, state: dict):
+        for name, value in state.items():
+            current = getattr(self, name)
+            if isinstance(current, dict):
+                merge_counts(current, value)
+            elif isinstance(current, list):
+                current.extend(value)
+            else:
+                setattr(self, name, current + value)
+
+
+# Base class of the insights. finalize turns what was collected into the {sheet_name: {description, headers, data}}
+# dict the results and sheet helpers understand.
+class Insight(Accumulator):
+    # Run fields the insight reads, see insights.reads
+    fields = frozenset()
+    # Accumulators shared with other insights (e.g. a cube several sheets are derived from), they're fed once per pass
+    # no matter how many insights read them
+    inputs = ()
+
+    def finalize(self) -> dict:
+        raise NotImplementedError
+
+
+def _accumulators(insights) -> list:
+    accumulators = []
+    for insight in insights:
+        for accumulator in (*insight.inputs, insight):
+            if not any(accumulator is known for known in accumulators):
+                accumulators.append(accumulator)
+    return accumulators
+
+
+# Feeds the runs to the accumulators shard by shard and returns the number of runs
+def _feed(runs: Iterable[dict], accumulators: list) -> int:
+    columnar = [accumulator for accumulator in accumulators if accumulator.columnar]
+    # Accumulators that only read shared inputs don't need the runs at all
+    row_updates = [accumulator.update for accumulator in accumulators
+                   if not accumulator.columnar and type(accumulator).update is not Accumulator.update]
+    shards = runs.shards() if isinstance(runs, RunSource) else [runs]
+    run_count = 0
+
+    for shard in shards:
+        if isinstance(shard, RunStore):
+            for accumulator in columnar:
+                accumulator.update_shard(shard)
+            updates = row_updates
+        else:
+            updates = row_updates + [accumulator.update for accumulator in columnar]
+
+        if updates or not isinstance(shard, RunStore):
+            for run in shard:
+                run_count += 1
+                for update in updates:
+                    update(run)
+        else:
+            run_count += len(shard)
+
+        if isinstance(shard, RunStore):
+            shard.release()
+
+    return run_count
+
+
+# Feeds every run to all insights in a single pass and returns their results in the order they were given
+def run_insights(runs: Iterable[dict], insights: list) -> list[dict]:
+    start = time.perf_counter()
+    run_count = _feed(runs, _accumulators(insights))
+    results = [insight.finalize() for insight in insights]
+    print(f"Computed {len(insights)} insights over {run_count} runs in {time.perf_counter() - start:.2f}s")
+    return results
+
+
+# Finalized results of the insights over the partitions with the given keys and the number of partitions that had to
+# be read because a partial was missing
+def _cached_results(cache, insights: list, keys: list) -> tuple[list[dict], int]:
+    accumulators = [accumulator for accumulator in _accumulators(insights) if accumulator.has_state]
+    computed = 0
+
+    for key in keys:
+        states = [cache.load_partial(key, accumulator.partial_name) for accumulator in accumulators]
+        missing = {index: accumulators[index].fresh() for index, state in enumerate(states) if state is None}
+        if missing:
+            _feed(cache.partition(key), list(missing.values()))
+            for index, accumulator in missing.items():
+                states[index] = accumulator.state()
+                cache.save_partial(key, accumulators[index].partial_name, states[index])
+            computed += 1
+
+        for accumulator, state in zip(accumulators, states):
+            accumulator.merge(state)
+
+    return [insight.finalize() for insight in insights], computed
+
+
+# Splits the insights into groups that share no accumulator, each group can be computed on its own.
+# Groups are lists of (position, insight), ordered by the position of their first insight.
+def independent_groups(insights: list) -> list[list]:
+    groups = []
+    for position, insight in enumerate(insights):
+        group = [(position, insight)]
+        for other in list(groups):
+            if any(accumulator is known for accumulator in insight.inputs for _, member in other for known in member.inputs):
+                groups.remove(other)
+                group = other + group
+        groups.append(sorted(group, key=lambda entry: entry[0]))
+    return sorted(groups, key=lambda group: group[0][0])
+
+
+# Whether any accumulator of the group reads the runs one by one, these groups have to rebuild every run
+def _row_based(group) -> bool:
+    return any(not accumulator.columnar and type(accumulator).update is not Accumulator.update
+               for accumulator in _accumulators([insight for _, insight in group]))
+
+
+# Bundles the groups into at most count buckets that are each computed in one fused pass. All row based groups share a
+# bucket so the runs are only rebuilt once, the columnar groups are spread over the other buckets.
+def group_buckets(groups: list, count: int) -> list[list]:
+    row_groups = [group for group in groups if _row_based(group)]
+    columnar_groups = [group for group in groups if not _row_based(group)]
+    buckets = [[entry for group in row_groups for entry in group]] if row_groups else []
+    columnar_buckets = [[] for _ in range(min(max(count - len(buckets), 1), len(columnar_groups)))]
+    for index, group in enumerate(columnar_groups):
+        columnar_buckets[index % len(columnar_buckets)].extend(group)
+    return [sorted(bucket, key=lambda entry: entry[0]) for bucket in buckets + columnar_buckets]
+
+
+# Worker entry point, opens its own view of the cache (the partitions are memory mapped, so the workers share the
+# pages instead of copying the runs) and computes one bucket of insights in a single pass
+def _cached_group_task(cache_dir, insights, keys):
+    return _cached_results(RunCache.open(cache_dir), insights, keys)
+
+
+# Computes the insights over the partitions of the cache between start and end (see RunCache.select). The partial state
+# of every accumulator is saved per partition, so a partition only gets read the first time. After that it costs
+# loading and merging its partials. The cache drops the partials of a partition when it rewrites it.
+# With more than one worker, groups of insights that share no accumulator are bundled into at most workers buckets (see
+# group_buckets) that are computed in separate processes, only their finalized results are sent back. The insights
+# given are then left untouched, their copies in the workers do the work. Every bucket still reads the partitions in
+# date order, so the results are the same as with a single worker.
+def run_cached_insights(cache, insights: list, start=None, end=None, workers=1) -> list[dict]:
+    start_time = time.perf_counter()
+    keys = keys_in_range(cache.keys(), start, end)
+    buckets = group_buckets(independent_groups(insights), workers) if workers > 1 else []
+
+    if len(buckets) > 1:
+        # Partitions from before the features existed derive them on first open, which writes to the cache.
+        # That happens here once so the workers only ever read.
+        for key in keys:
+            cache.partition(key)
+        cache.save()
+
+        results = [None] * len(insights)
+        computed = 0
+        with ProcessPoolExecutor(max_workers=len(buckets)) as executor:
+            bucket_insights = [[insight for _, insight in bucket] for bucket in buckets]
+            for bucket, (bucket_results, bucket_computed) in zip(
+                    buckets, executor.map(_cached_group_task, repeat(cache.cache_dir), bucket_insights, repeat(keys))):
+                for (position, _), result in zip(bucket, bucket_results):
+                    results[position] = result
+                computed = max(computed, bucket_computed)
+    else:
+        results, computed = _cached_results(cache, insights, keys)
+
+    print(f"Computed {len(insights)} insights over {len(keys)} partitions ({computed} read, the rest from saved partials) "
+          f"in {time.perf_counter() - start_time:.2f}s")
+    return results
+
+
+# Computes the insights separately for every segment of the runs in a single pass. segment_of maps a run to the key of
+# its segment (runs mapped to None are skipped) and make_insights returns a new list of insights, it's called once per
+# segment the first time the segment shows up. Every run is read once and only fed to the insights of its own segment.
+# RunStore shards are split into one store per segment (see RunStore.take) that is fed like a shard, so columnar
+# accumulators keep their update_shard. Segment keys with a field attribute only read that column of the store (see
+# RunStore.map_field), other keys are given the rebuilt runs.
+# Returns {segment: results} with the segments in the order they were first seen, see results.segment_sheets.
+def run_segmented_insights(runs: Iterable[dict], make_insights, segment_of) -> dict:
+    start = time.perf_counter()
+    segments = {}
+    accumulators = {}
+    run_count = 0
+
+    def segment_accumulators(segment):
+        if segment not in segments:
+            segments[segment] = make_insights()
+            accumulators[segment] = _accumulators(segments[segment])
+        return accumulators[segment]
+
+    field = getattr(segment_of, "field", None)
+    shards = runs.shards() if isinstance(runs, RunSource) else [runs]
+    for shard in shards:
+        if isinstance(shard, RunStore):
+            keys = shard.map_field(field, segment_of) if field is not None else [segment_of(run) for run in shard]
+            rows = {}
+            for index, segment in enumerate(keys):
+                if segment is not None:
+                    rows.setdefault(segment, []).append(index)
+            for segment, indices in rows.items():
+                _feed(shard.take(indices), segment_accumulators(segment))
+            run_count += len(shard)
+            shard.release()
+            continue
+
+        for run in shard:
+            run_count += 1
+            segment = segment_of(run)
+            if segment is None:
+                continue
+            for accumulator in segment_accumulators(segment):
+                accumulator.update(run)
+
+    results = {segment: [insight.finalize() for insight in insights] for segment, insights in segments.items()}
+    print(f"Computed {len(results)} segments of insights over {run_count} runs in {time.perf_counter() - start:.2f}s")
+    return results
+
+
+# Segment keys for run_segmented_insights, their field is the only run field they read
+
+# Ascension levels in bands of the given size, e.g. "A15-A19"
+def ascension_band(size: int = 5):
+    def segment_of(run):
+        level = run.get("ascension_level")
+        if type(level) is not int:
+            return None
+        low = level - level % size
+        return f"A{low}-A{low + size - 1}" if size > 1 else f"A{level}"
+
+    segment_of.field = "ascension_level"
+    return segment_of
+
+
+# YYYY-MM of the time the run was uploaded
+def run_month(run):
+    timestamp = run.get("time")
+    if type(timestamp) is not int:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m")
+
+
+run_month.field = "time"
+
+
+def expansion_packs_enabled(run):
+    return "Expansion" if run.get("enabledExpansionPacks") else "No Expansion"
+
+
+expansion_packs_enabled.field = "enabledExpansionPacks"
+
+
+# The host for the given hosts (e.g. the top hosts of the Runs by Host sheet), None for everyone else
+def host_in(hosts):
+    hosts = set(hosts)
+
+    def segment_of(run):
+        host = run.get("host")
+        return host if host in hosts else None
+
+    segment_of.field = "host"
+    return segment_of
+
+
+def run_insight(insight: Insight, runs: Iterable[dict]) -> dict:
+    _feed(runs, _accumulators([insight]))
+    return insight.finalize()
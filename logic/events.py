@@ -0,0 +1,139 @@
+import numpy as np
+
+from logic.transformations import split_upgrade
+
+
+# Upgrades of a card, int16 like the turns (modded cards like Searing Blow can be upgraded more than int8 holds).
+# Anything past the int16 range is clamped instead of failing the whole table.
+def _upgrade_column(upgrades):
+    return np.clip(np.array(upgrades, dtype=np.int64), 0, np.iinfo(np.int16).max).astype(np.int16)
+
+
+# Floor of an event, -1 if the run didn't record one
+def floor_of(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+# Every card offered in a card reward: the run it happened in (index in the partition), the floor, the interned card
+# without its upgrade, the upgrade and whether it was the picked card
+def card_choice_events(runs, interners) -> dict:
+    intern = interners["cards"].intern
+    run_indices, floors, cards, upgrades, picked = [], [], [], [], []
+
+    def add(index, floor, card, was_picked):
+        base, upgrade = split_upgrade(card)
+        run_indices.append(index)
+        floors.append(floor)
+        cards.append(intern(base))
+        upgrades.append(upgrade)
+        picked.append(was_picked)
+
+    for index, run in enumerate(runs):
+        for choice in run.get("card_choices", []):
+            floor = floor_of(choice.get("floor"))
+            if choice.get("picked") is not None:
+                add(index, floor, choice["picked"], True)
+            for card in choice.get("not_picked", []):
+                add(index, floor, card, False)
+
+    return {
+        "run": np.array(run_indices, dtype=np.int32),
+        "floor": np.array(floors, dtype=np.int16),
+        "card": np.array(cards, dtype=np.int32),
+        "upgrade": _upgrade_column(upgrades),
+        "picked": np.array(picked, dtype=np.int8),
+    }
+
+
+# Every fight of damage_taken: the run, the floor, the interned enemies, the turns it took and the damage taken
+def fight_events(runs, interners) -> dict:
+    intern = interners["enemies"].intern
+    run_indices, floors, enemies, turns, damage = [], [], [], [], []
+
+    for index, run in enumerate(runs):
+        for entry in run.get("damage_taken", []):
+            run_indices.append(index)
+            floors.append(floor_of(entry.get("floor")))
+            enemies.append(intern(entry.get("enemies", "")))
+            turns.append(entry.get("turns", 0))
+            damage.append(entry.get("damage", 0))
+
+    return {
+        "run": np.array(run_indices, dtype=np.int32),
+        "floor": np.array(floors, dtype=np.int16),
+        "enemy": np.array(enemies, dtype=np.int32),
+        "turns": np.array(turns, dtype=np.int16),
+        "damage": np.array(damage, dtype=np.float64),
+    }
+
+
+# Action codes of the campfire table, actions that aren't listed get OTHER_ACTION
+CAMPFIRE_ACTIONS = ["REST", "SMITH", "LIFT", "DIG", "PURGE", "RECALL"]
+ACTION_CODES = {action: code for code, action in enumerate(CAMPFIRE_ACTIONS)}
+OTHER_ACTION = len(CAMPFIRE_ACTIONS)
+
+
+# Value of a per floor list at the floor, -1 if the list doesn't reach it
+def _at_floor(values, floor) -> int:
+    return values[floor] if 0 <= floor < len(values) else -1
+
+
+# Every campfire choice: the run, the floor, the action code, the target card without its upgrade (-1 without a
+# target) and its upgrade, joined with the current and max HP of the run at that floor (-1 if the run has none)
+def campfire_events(runs, interners) -> dict:
+    intern = interners["cards"].intern
+    run_indices, floors, actions, cards, upgrades, hp, max_hp = [], [], [], [], [], [], []
+
+    for index, run in enumerate(runs):
+        current_hp_per_floor = run.get("current_hp_per_floor", [])
+        max_hp_per_floor = run.get("max_hp_per_floor", [])
+        for choice in run.get("campfire_choices", []):
+            floor = floor_of(choice.get("floor"))
+            target = choice.get("data")
+            if type(target) is str:
+                base, upgrade = split_upgrade(target)
+                card = intern(base)
+            else:
+                card, upgrade = -1, 0
+
+            run_indices.append(index)
+            floors.append(floor)
+            actions.append(ACTION_CODES.get(choice.get("key"), OTHER_ACTION))
+            cards.append(card)
+            upgrades.append(upgrade)
+            hp.append(_at_floor(current_hp_per_floor, floor))
+            max_hp.append(_at_floor(max_hp_per_floor, floor))
+
+    return {
+        "run": np.array(run_indices, dtype=np.int32),
+        "floor": np.array(floors, dtype=np.int16),
+        "action": np.array(actions, dtype=np.int8),
+        "card": np.array(cards, dtype=np.int32),
+        "upgrade": _upgrade_column(upgrades),
+        "hp": np.array(hp, dtype=np.int32),
+        "max_hp": np.array(max_hp, dtype=np.int32),
+    }
+
+
+# Act of a floor (the boss chest floor still counts to the act of its boss), works on numpy arrays as well
+def act_of(floor):
+    return 1 + (floor > 17) + (floor > 34) + (floor > 51)
+
+
+# Flat tables of the nested lists in the runs, one row per event: name -> (version, function deriving the columns).
+# They're derived when a partition is written and saved next to it, tables with another version are derived again.
+EVENT_TABLES = {
+    "card_choices": (2, card_choice_events),
+    "fights": (1, fight_events),
+    "campfire": (2, campfire_events),
+}
+
+
+# Derives the event tables (all of them if names is None) from the runs, strings are interned into the interners
+def derive_events(runs, interners, names=None) -> dict:
+    runs = runs if isinstance(runs, list) else list(runs)
+    names = EVENT_TABLES if names is None else names
+    return {name: EVENT_TABLES[name][1](runs, interners) for name in names}
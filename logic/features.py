@@ -0,0 +1,62 @@
+from typing import NamedTuple
+
+from logic.transformations import del_upg
+
+# Key the derived features are attached under in a run dict
+FEATURES_KEY = "_features"
+
+# Version of the derivation, cached features with another version are derived again
+FEATURES_VERSION = 3
+
+GEMS_PACK = "anniv5:GemsPack"
+GEM_MODIFIER_PREFIX = "thePackmaster.cardmodifiers.gemspack"
+
+
+# Values several insights need from a run, derived once per run instead of once per insight
+class RunFeatures(NamedTuple):
+    packs: tuple  # currentPacks split into packs, without empty entries and packs listed twice
+    deck: tuple  # master_deck cards without their upgrade
+    smith_targets: tuple  # Cards upgraded at campfires
+    rest_floors: tuple  # Floors the player rested at
+    gem_types: tuple  # Class name (without package) of every gem modifier slotted into a card
+    gem_count: int  # Gem modifiers slotted into cards
+    has_card_modifiers: bool  # Whether any card had a modifier
+    gems_pack: bool  # Whether the gems pack is one of the run's packs
+
+
+# The gem modifiers of the cards, decoded once so the gem insights only count
+def _gem_types(card_modifiers) -> tuple:
+    gem_types = []
+    for mod_list in card_modifiers:
+        if mod_list:
+            for mod in mod_list:
+                classname = mod.get('classname', '') if mod else ''
+                if GEM_MODIFIER_PREFIX in classname:
+                    gem_types.append(classname.rsplit('.', 1)[-1])
+    return tuple(gem_types)
+
+
+def derive_features(run: dict) -> RunFeatures:
+    packs = tuple(dict.fromkeys(pack for pack in run.get("currentPacks", "").split(",") if pack))
+    deck = tuple(del_upg(card) for card in run.get("master_deck", []))
+
+    smith_targets = []
+    rest_floors = []
+    for choice in run.get("campfire_choices", []):
+        if choice["key"] == "SMITH":
+            smith_targets.append(choice["data"])
+        elif choice["key"] == "REST":
+            rest_floors.append(int(choice["floor"]))
+
+    card_modifiers = run.get("basemod:card_modifiers", [])
+    gem_types = _gem_types(card_modifiers)
+    return RunFeatures(packs, deck, tuple(smith_targets), tuple(rest_floors), gem_types,
+                       len(gem_types), any(card_modifiers), GEMS_PACK in packs)
+
+
+# Features of the run, runs coming from the cache already carry them, anything else is derived on first access
+def features_of(run: dict) -> RunFeatures:
+    features = run.get(FEATURES_KEY)
+    if features is None:
+        features = run[FEATURES_KEY] = derive_features(run)
+    return features
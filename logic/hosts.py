@@ -0,0 +1,158 @@
+import numpy as np
+
+from logic.engine import Accumulator
+from logic.sketches import HyperLogLog, SpaceSaving
+from logic.storage import Interner
+
+
+# Dimension table of the hosts that the host based insights read: every host gets an interned id with its number of
+# runs and a bitset (an int, bit = interned pack id) of the packs it blacklisted. A pack is counted once per host, the
+# number of hosts that blacklisted it is kept per pack id. Runs from a RunStore are grouped with numpy and only the
+# unique (host, pack) pairs of the shard are added one by one.
+class HostTable(Accumulator):
+    columnar = True
+    estimated = False
+
+    def __init__(self):
+        self.hosts = Interner()
+        self.packs = Interner()
+        self.runs = []  # host id -> runs
+        self.blacklists = []  # host id -> bitset of blacklisted packs
+        self.blacklisted_by = []  # pack id -> hosts that blacklisted the pack
+
+    def _host(self, host) -> int:
+        host_id = self.hosts.intern(host)
+        if host_id == len(self.runs):
+            self.runs.append(0)
+            self.blacklists.append(0)
+        return host_id
+
+    def _pack(self, pack) -> int:
+        pack_id = self.packs.intern(pack)
+        if pack_id == len(self.blacklisted_by):
+            self.blacklisted_by.append(0)
+        return pack_id
+
+    def _blacklist(self, host_id, pack_ids):
+        known = self.blacklists[host_id]
+        for pack_id in pack_ids:
+            bit = 1 << pack_id
+            if not known & bit:
+                known |= bit
+                self.blacklisted_by[pack_id] += 1
+        self.blacklists[host_id] = known
+
+    def update(self, run):
+        host = run.get("host")
+        if not host:
+            return
+        host_id = self._host(host)
+        self.runs[host_id] += 1
+
+        filtered_packs = run.get("filteredPacks", "")
+        if filtered_packs:
+            self._blacklist(host_id, [self._pack(pack) for pack in filtered_packs.split(",")])
+
+    def update_shard(self, store):
+        names = store.interners["hosts"].values
+        hosts = np.asarray(store.columns["host"], dtype=np.int64)
+        has_host = store.field_mask("host") & (hosts != store.interners["hosts"].get(""))
+
+        # Hosts are interned in the order they first show up, like one run at a time
+        host_ids, first, runs = np.unique(hosts[has_host], return_index=True, return_counts=True)
+        for position in np.argsort(first, kind='stable').tolist():
+            self.runs[self._host(names[host_ids[position]])] += int(runs[position])
+
+        offsets = store.columns["filteredPacks.offsets"]
+        packs = np.asarray(store.columns["filteredPacks.values"], dtype=np.int64)
+        pack_runs = np.repeat(np.arange(len(store)), np.diff(offsets))
+        kept = has_host[pack_runs]
+        packs, pack_hosts = packs[kept], hosts[pack_runs[kept]]
+        if len(packs) == 0:
+            return
+
+        # Unique (host, pack) pairs in the order they first show up
+        pack_names = store.interners["packs"].values
+        pairs, first = np.unique(pack_hosts * len(pack_names) + packs, return_index=True)
+        for pair in pairs[np.argsort(first, kind='stable')].tolist():
+            host_id, pack_id = divmod(pair, len(pack_names))
+            self._blacklist(self.hosts.get(names[host_id]), [self._pack(pack_names[pack_id])])
+
+    def state(self):
+        return {"hosts": list(self.hosts.values), "packs": list(self.packs.values), "runs": list(self.runs),
+                "blacklists": list(self.blacklists)}
+
+    def merge(self, state):
+        # Packs first, in the order of the state, so they're numbered like in a single pass
+        pack_ids = [self._pack(pack) for pack in state["packs"]]
+        for host, runs, blacklist in zip(state["hosts"], state["runs"], state["blacklists"]):
+            host_id = self._host(host)
+            self.runs[host_id] += runs
+            self._blacklist(host_id, [pack_ids[pack] for pack in _bits(blacklist)])
+
+    # Packs the host blacklisted in any of its runs
+    def blacklisted(self, host) -> list:
+        host_id = self.hosts.get(host)
+        if host_id < 0:
+            return []
+        return [self.packs[pack_id] for pack_id in _bits(self.blacklists[host_id])]
+
+    # {pack: hosts that blacklisted it} in the order the packs were first blacklisted
+    def blacklist_counts(self) -> dict:
+        return dict(zip(self.packs.values, self.blacklisted_by))
+
+    # [(host, runs)] with the most runs first, ties in the order the hosts first show up
+    def most_active(self) -> list:
+        return sorted(zip(self.hosts.values, self.runs), key=lambda item: item[1], reverse=True)
+
+
+# Indices of the set bits of an int
+def _bits(bitset: int) -> list:
+    indices = []
+    while bitset:
+        lowest = bitset & -bitset
+        indices.append(lowest.bit_length() - 1)
+        bitset ^= lowest
+    return indices
+
+
+# Fixed memory stand-in for HostTable with estimated counts: a HyperLogLog of the hosts per blacklisted pack and a
+# Space-Saving top-k of the hosts by runs (see sketches.py for their error bounds). Its size depends on the number of
+# packs and the sketch settings, not on the number of hosts.
+class HostSketch(Accumulator):
+    estimated = True
+    state_fields = ("active", "blacklisted_by")
+
+    def __init__(self, precision: int = 12, capacity: int = 1000):
+        self.precision = precision
+        self.capacity = capacity
+        self.active = SpaceSaving(capacity)
+        self.blacklisted_by = {}  # pack -> HyperLogLog of the hosts that blacklisted it
+
+    def fresh(self):
+        return type(self)(self.precision, self.capacity)
+
+    # The settings go before the version, sketches with other settings can't be merged with these partials
+    @property
+    def partial_name(self) -> str:
+        return f"{type(self).__name__}-p{self.precision}-k{self.capacity}.v{self.version}"
+
+    def update(self, run):
+        host = run.get("host")
+        if not host:
+            return
+        self.active.add(host)
+
+        filtered_packs = run.get("filteredPacks", "")
+        if filtered_packs:
+            for pack in filtered_packs.split(","):
+                hosts = self.blacklisted_by.get(pack)
+                if hosts is None:
+                    hosts = self.blacklisted_by[pack] = HyperLogLog(self.precision)
+                hosts.add(host)
+
+    def blacklist_counts(self) -> dict:
+        return {pack: hosts.count() for pack, hosts in self.blacklisted_by.items()}
+
+    def most_active(self) -> list:
+        return self.active.most_common()
@@ -2,434 +2,789 @@ import re
 import statistics
 from collections import Counter
 from collections import defaultdict
+from collections.abc import Iterable
 
+import numpy as np
+
+from logic.bitmaps import Bitmap, pack_rows
+from logic.engine import Accumulator, Insight, run_insight
+from logic.events import ACTION_CODES, act_of, floor_of
+from logic.features import features_of
+from logic.hosts import HostSketch, HostTable
+from logic.sketches import QuantileSketch, histogram_median, histogram_quantile
 from logic.transformations import *
 
+# Run fields read by each insight, the loader only keeps the union of these
+INSIGHT_FIELDS = {}
 
-# Counts the number of packs filtered by each player and prints the most common ones.
-def sum_filtered_packs(runs: list[dict]) -> dict:
-    word_counts = Counter()
-    host_word_counts = {}
 
-    for data_dict in runs:
-        host = data_dict.get("host")
-        filtered_packs = data_dict.get("filteredPacks", "")
+# Declares which run fields an insight reads
+def reads(*fields):
+    def decorator(insight):
+        insight.fields = frozenset(fields)
+        INSIGHT_FIELDS[insight.__name__] = insight.fields
+        return insight
+
+    return decorator
+
+
+# Union of the fields read by the given insights (or all of them)
+def required_fields(insights=None) -> set:
+    if insights is None:
+        return set().union(*INSIGHT_FIELDS.values())
+    return set().union(*(insight.fields for insight in insights))
+
+
+# Base of the insights counting by CardCatalog card id. The ids depend on the order the catalog saw the cards in, so
+# partial states are saved by card name and only reused with the same pack and rarity data.
+class CatalogInsight(Insight):
+    def __init__(self, catalog: CardCatalog):
+        self.catalog = catalog
+
+    def fresh(self):
+        return type(self)(self.catalog)
+
+    @property
+    def partial_name(self) -> str:
+        return f"{super().partial_name}.{self.catalog.fingerprint}"
+
+    def state(self):
+        cards = self.catalog.cards
+        return {name: {cards[card_id]: value for card_id, value in getattr(self, name).items()}
+                for name in self.state_fields}
+
+    def merge(self, state):
+        card_id = self.catalog.card_id
+        super().merge({name: {card_id(card): value for card, value in counts.items()} for name, counts in state.items()})
+
+    # Card choice events of the store (see events.card_choice_events) with catalog card ids and whether the card's
+    # pack is one of the run's packs, None if the store has no card choice table
+    def choice_events(self, store):
+        if not store.events or "card_choices" not in store.events or store.features is None:
+            return None
+        events = store.events["card_choices"]
+        catalog = self.catalog
+        cards = np.array(catalog.interned_card_ids(store.interners["cards"]), dtype=np.int64)[events["card"]]
+        card_packs = np.array(catalog.card_pack, dtype=np.int64)[cards]
+        event_runs = np.asarray(events["run"], dtype=np.int64)
+
+        # The packs of every run as run * width + catalog pack id, so membership is a single isin
+        width = len(catalog.packs) + 1
+        run_packs = np.array(catalog.interned_pack_ids(store.interners["packs"]), dtype=np.int64)[store.features["packs.values"]]
+        pack_runs = np.repeat(np.arange(len(store)), np.diff(store.features["packs.offsets"]))
+        known = run_packs >= 0
+        in_run_packs = (card_packs >= 0) & np.isin(event_runs * width + card_packs, pack_runs[known] * width + run_packs[known])
 
-        if not host or not filtered_packs:
-            continue
+        return {"run": event_runs, "floor": np.asarray(events["floor"]), "card": cards,
+                "upgrade": np.asarray(events["upgrade"]), "picked": np.asarray(events["picked"]) != 0,
+                "in_run_packs": in_run_packs}
 
-        if host not in host_word_counts:
-            host_word_counts[host] = Counter()
 
-        words = filtered_packs.split(",")
+# Campfire events of the store (see events.campfire_events), None if the store has no campfire table
+def _campfire_events(store):
+    if not store.events or "campfire" not in store.events:
+        return None
+    return {name: np.asarray(column) for name, column in store.events["campfire"].items()}
 
-        # Count words that haven't been counted for this host before
-        new_words = [word for word in words if word not in host_word_counts[host]]
-        word_counts.update(new_words)
 
-        # Update host_word_counts for this host with the newly counted words
-        host_word_counts[host].update(new_words)
+# Adds how often every id occurs to the counter, ids new to the counter are added in the order they first occur
+def _count_ids(counter: Counter, ids):
+    values, first, counts = np.unique(ids, return_index=True, return_counts=True)
+    for position in np.argsort(first, kind='stable').tolist():
+        counter[int(values[position])] += int(counts[position])
 
-    # Create the data rows sorted by the most filtered packs
-    sorted_packs = sorted(word_counts.items(), key=lambda item: item[1], reverse=True)
-    data_rows = [[del_prefix(pack), count] for pack, count in sorted_packs]
 
-    insights = {
-        "Blacklisted Packs": {
-            "description": "How often a pack is blacklisted by unique hosts",
-            "headers": ["Pack", "Blacklisted"],
-            "data": data_rows
+# Base of the insights derived from the host dimension table (a HostTable, or a HostSketch for estimated counts in
+# fixed memory), insights given the same table share it
+class HostInsight(Insight):
+    def __init__(self, hosts=None):
+        self.hosts = hosts if hosts is not None else HostTable()
+        self.inputs = (self.hosts,)
+
+    def _estimated(self, description: str) -> str:
+        return f"{description} (estimated)" if self.hosts.estimated else description
+
+
+# Counts the number of packs filtered by each player and prints the most common ones.
+@reads("host", "filteredPacks")
+class FilteredPacks(HostInsight):
+    def finalize(self):
+        # Create the data rows sorted by the most filtered packs
+        sorted_packs = sorted(self.hosts.blacklist_counts().items(), key=lambda item: item[1], reverse=True)
+        data_rows = [[del_prefix(pack), count] for pack, count in sorted_packs]
+
+        insights = {
+            "Blacklisted Packs": {
+                "description": self._estimated("How often a pack is blacklisted by unique hosts"),
+                "headers": ["Pack", "Blacklisted"],
+                "data": data_rows
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def sum_filtered_packs(runs: Iterable[dict]) -> dict:
+    return run_insight(FilteredPacks(), runs)
 
 
 # Counts the number of runs with enabledExpansionPacks and prints the ratio.
-def count_enabled_expansion_packs(runs: list[dict]) -> dict:
-    enabled_count = 0
-    total_count = len(runs)
+@reads("enabledExpansionPacks")
+class ExpansionPackUsage(Insight):
+    state_fields = ("enabled_count", "total_count")
+
+    def __init__(self):
+        self.enabled_count = 0
+        self.total_count = 0
 
-    for data_dict in runs:
+    def update(self, data_dict):
+        self.total_count += 1
         if data_dict.get("enabledExpansionPacks"):
-            enabled_count += 1
+            self.enabled_count += 1
+
+    def finalize(self):
+        ratio = make_ratio(self.enabled_count, self.total_count)
+
+        # Construct the insights dictionary for this particular analysis
+        insights = {
+            "Expansion Pack Usage": {
+                "description": "Percentage of runs with expansion packs enabled",
+                "headers": ["Enabled", "Total Runs", "Percentage Enabled"],
+                "data": [
+                    [self.enabled_count, self.total_count, ratio]
+                ]
+            }
+        }
 
-    ratio = make_ratio(enabled_count, total_count)
+        return insights
 
-    # Construct the insights dictionary for this particular analysis
-    insights = {
-        "Expansion Pack Usage": {
-            "description": "Percentage of runs with expansion packs enabled",
-            "headers": ["Enabled", "Total Runs", "Percentage Enabled"],
-            "data": [
-                [enabled_count, total_count, ratio]
-            ]
-        }
-    }
 
-    return insights
+def count_enabled_expansion_packs(runs: Iterable[dict]) -> dict:
+    return run_insight(ExpansionPackUsage(), runs)
 
 
 # Counts the number of times each pack was picked and prints the results.
-def pack_pick_rate(runs: list[dict]) -> dict:
-    picked_counts = Counter()
-    not_picked_counts = Counter()
-    result = []
+@reads("packChoices")
+class PackPickRate(Insight):
+    state_fields = ("picked_counts", "not_picked_counts")
 
-    for data_dict in runs:
+    def __init__(self):
+        self.picked_counts = Counter()
+        self.not_picked_counts = Counter()
+
+    def update(self, data_dict):
         pack_choices = data_dict.get("packChoices", [])
         for choice in pack_choices:
             picked = choice.get("picked", "")
             not_picked = choice.get("not_picked", [])
 
             # Count picked choices
-            picked_counts.update([picked])
+            self.picked_counts[picked] += 1
 
             # Count not picked choices
-            not_picked_counts.update(not_picked)
-
-    for choice, picked_count in picked_counts.items():
-        not_picked_count = not_picked_counts[choice]
-        total_count = picked_count + not_picked_count
-        pick_rate = make_ratio(picked_count, total_count)
-        result.append([del_prefix(choice), picked_count, total_count, pick_rate])
-
-    # Sort the results by pick rate
-    sorted_result = sorted(result, key=lambda x: float(x[3]), reverse=True)
-
-    insights = {
-        "Pack Pick Rate": {
-            "description": "How often a pack is picked",
-            "headers": ["Pack", "Picked", "Seen", "Pick Rate"],
-            "data": sorted_result
+            self.not_picked_counts.update(not_picked)
+
+    def finalize(self):
+        result = []
+        for choice, picked_count in self.picked_counts.items():
+            not_picked_count = self.not_picked_counts[choice]
+            total_count = picked_count + not_picked_count
+            pick_rate = make_ratio(picked_count, total_count)
+            result.append([del_prefix(choice), picked_count, total_count, pick_rate])
+
+        # Sort the results by pick rate
+        sorted_result = sorted(result, key=lambda x: float(x[3]), reverse=True)
+
+        insights = {
+            "Pack Pick Rate": {
+                "description": "How often a pack is picked",
+                "headers": ["Pack", "Picked", "Seen", "Pick Rate"],
+                "data": sorted_result
+            }
         }
-    }
 
-    return insights
+        return insights
 
 
-def count_most_common_players(runs: list[dict]) -> dict:
-    host_counts = Counter()
+def pack_pick_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(PackPickRate(), runs)
 
-    for data_dict in runs:
-        host = data_dict.get("host")
-        if host:
-            host_counts[host] += 1
 
-    most_common_hosts = host_counts.most_common()
+@reads("host")
+class RunsByHost(HostInsight):
+    def finalize(self):
+        most_common_hosts = self.hosts.most_active()
 
-    insights = {
-        "Runs by Host": {
-            "description": "Number of runs for hosts with at least 20 runs",
-            "headers": ["Host", "Runs"],
-            "data": []
+        insights = {
+            "Runs by Host": {
+                "description": self._estimated("Number of runs for hosts with at least 20 runs"),
+                "headers": ["Host", "Runs"],
+                "data": []
+            }
         }
-    }
 
-    # Populate the data list with hosts that meet the threshold
-    for host, count in most_common_hosts:
-        if count >= 20:
-            insights["Runs by Host"]["data"].append([host, count])
+        # Populate the data list with hosts that meet the threshold
+        for host, count in most_common_hosts:
+            if count >= 20:
+                insights["Runs by Host"]["data"].append([host, count])
+
+        return insights
 
-    return insights
 
+def count_most_common_players(runs: Iterable[dict]) -> dict:
+    return run_insight(RunsByHost(), runs)
 
-def hat_pick_rate(runs: list[dict]) -> dict:
-    picked_hat_counts = Counter()
 
-    for data_dict in runs:
+@reads("pickedHat")
+class HatPickRate(Insight):
+    state_fields = ("picked_hat_counts", "total_runs")
+
+    def __init__(self):
+        self.picked_hat_counts = Counter()
+        self.total_runs = 0
+
+    def update(self, data_dict):
+        self.total_runs += 1
         picked_hat = data_dict.get("pickedHat")
         if picked_hat:
-            picked_hat_counts[picked_hat] += 1
-
-    total_runs = len(runs)
-    insights = {
-        "Hat Pick Rate": {
-            "description": "Pick rate for each hat",
-            "headers": ["Hat", "Count", "Pick Rate"],
-            "data": []
+            self.picked_hat_counts[picked_hat] += 1
+
+    def finalize(self):
+        insights = {
+            "Hat Pick Rate": {
+                "description": "Pick rate for each hat",
+                "headers": ["Hat", "Count", "Pick Rate"],
+                "data": []
+            }
         }
-    }
 
-    # Populate the data part of the insights dictionary
-    for picked_hat, count in picked_hat_counts.most_common():
-        pick_rate = make_ratio(count, total_runs)
-        insights["Hat Pick Rate"]["data"].append([del_prefix(picked_hat), count, pick_rate])
+        # Populate the data part of the insights dictionary
+        for picked_hat, count in self.picked_hat_counts.most_common():
+            pick_rate = make_ratio(count, self.total_runs)
+            insights["Hat Pick Rate"]["data"].append([del_prefix(picked_hat), count, pick_rate])
+
+        return insights
 
-    return insights
 
+def hat_pick_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(HatPickRate(), runs)
 
-def pack_win_rate(runs: list[dict]) -> dict:
-    pack_wins = {}
-    pack_runs = {}
 
-    for data_dict in runs:
+# Runs and wins per pack. A run counts once for every pack it has, even if currentPacks lists the pack twice, on both
+# the row and the bitmap path.
+@reads("victory", "currentPacks")
+class PackWinRate(Insight):
+    columnar = True
+    version = 2
+    state_fields = ("pack_wins", "pack_runs")
+
+    def __init__(self):
+        self.pack_wins = {}
+        self.pack_runs = {}
+
+    def update(self, data_dict):
         victory = data_dict.get("victory", False)
-        current_packs = data_dict.get("currentPacks", "").split(",")
 
-        for pack in current_packs:
-            if pack:
-                pack_wins[pack] = pack_wins.get(pack, 0) + int(victory)
-                pack_runs[pack] = pack_runs.get(pack, 0) + 1
-
-    sorted_packs = sorted(
-        pack_wins.keys(),
-        key=lambda pack: (pack_wins[pack] / pack_runs[pack] if pack_runs[pack] > 0 else 0),
-        reverse=True
-    )
-
-    insights = {
-        "Pack Win Rate": {
-            "description": "Win rate for each pack",
-            "headers": ["Pack", "Wins", "Total", "Win Rate"],
-            "data": []
+        for pack in features_of(data_dict).packs:
+            self.pack_wins[pack] = self.pack_wins.get(pack, 0) + int(victory)
+            self.pack_runs[pack] = self.pack_runs.get(pack, 0) + 1
+
+    # Runs and wins of every pack are popcounts of its bitmap, alone and ANDed with the victories
+    def update_shard(self, store):
+        index = store.index
+        for pack, runs in index.packs().items():
+            self.pack_wins[pack] = self.pack_wins.get(pack, 0) + (runs & index.victory).count()
+            self.pack_runs[pack] = self.pack_runs.get(pack, 0) + runs.count()
+
+    def finalize(self):
+        pack_wins, pack_runs = self.pack_wins, self.pack_runs
+        # Packs with the same win rate are sorted by name, so the order doesn't depend on the order they were counted in
+        sorted_packs = sorted(
+            pack_wins.keys(),
+            key=lambda pack: (-(pack_wins[pack] / pack_runs[pack] if pack_runs[pack] > 0 else 0), pack)
+        )
+
+        insights = {
+            "Pack Win Rate": {
+                "description": "Win rate for each pack",
+                "headers": ["Pack", "Wins", "Total", "Win Rate"],
+                "data": []
+            }
         }
-    }
 
-    for pack in sorted_packs:
-        wins = pack_wins[pack]
-        total_runs = pack_runs.get(pack, 0)
-        win_rate = make_ratio(wins, total_runs)
-        insights["Pack Win Rate"]["data"].append([del_prefix(pack), wins, total_runs, win_rate])
+        for pack in sorted_packs:
+            wins = pack_wins[pack]
+            total_runs = pack_runs.get(pack, 0)
+            win_rate = make_ratio(wins, total_runs)
+            insights["Pack Win Rate"]["data"].append([del_prefix(pack), wins, total_runs, win_rate])
 
-    return insights
+        return insights
 
 
-# Count card picks of current run cards (counts upgraded cards seperately)
-def card_pick_rate(runs: list[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
-    picked_counts = Counter()
-    not_picked_counts = Counter()
-    result = []
+def pack_win_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(PackWinRate(), runs)
+
 
-    for data_dict in runs:
-        current_packs = set(data_dict.get("currentPacks", "").split(","))
+# Count card picks of current run cards (counts upgraded cards seperately)
+@reads("currentPacks", "card_choices")
+class CardPickRate(CatalogInsight):
+    columnar = True
+    state_fields = ("picked_counts", "not_picked_counts")
+
+    def __init__(self, catalog: CardCatalog):
+        super().__init__(catalog)
+        self.picked_counts = Counter()
+        self.not_picked_counts = Counter()
+
+    def update(self, data_dict):
+        lookup = self.catalog.lookup
         card_choices = data_dict.get("card_choices", [])
         for choice in card_choices:
-            picked = del_upg(choice.get("picked"))
-            not_picked = [del_upg(card) for card in choice.get("not_picked", [])]
-            picked_counts.update([picked])
-            not_picked_counts.update(not_picked)
-
-    for choice, picked_count in picked_counts.items():
-        rar = card_to_rarity.get(choice, "Unknown")
-        if rar != "Special" and card_to_pack.get(choice):
-            not_picked_count = not_picked_counts[choice]
-            total_count = picked_count + not_picked_count
-            pick_rate = make_ratio(picked_count, total_count)
+            self.picked_counts[lookup(choice.get("picked")).card_id] += 1
+            for card in choice.get("not_picked", []):
+                self.not_picked_counts[lookup(card).card_id] += 1
+
+    def update_shard(self, store):
+        events = self.choice_events(store)
+        if events is None:
+            return super().update_shard(store)
+        picked = events["picked"]
+        _count_ids(self.picked_counts, events["card"][picked])
+        _count_ids(self.not_picked_counts, events["card"][~picked])
+
+    def finalize(self):
+        catalog = self.catalog
+        result = []
+        for card_id, picked_count in self.picked_counts.items():
+            rar = catalog.rarity_of(card_id)
+            if rar != "Special" and catalog.card_pack[card_id] >= 0:
+                not_picked_count = self.not_picked_counts[card_id]
+                total_count = picked_count + not_picked_count
+                pick_rate = make_ratio(picked_count, total_count)
+
+                result.append([rar,
+                               del_prefix(catalog.pack_of(card_id)),
+                               del_prefix(catalog.cards[card_id]),
+                               picked_count,
+                               not_picked_count + picked_count,
+                               pick_rate])
+
+        # Sort the results by pick rate in descending order, cards with the same pick rate by pack and name so the order
+        # doesn't depend on the order they were counted in
+        sorted_result = sorted(result, key=lambda x: (-float(x[5]), x[1], x[2]))
+
+        insights = {
+            "Card Pick Rate": {
+                "description": "How often a card is picked when offered as a card reward",
+                "headers": ["Rarity", "Pack", "Card", "Picked", "Seen", "Pick Rate"],
+                "data": sorted_result
+            }
+        }
 
-            result.append([rar,
-                           del_prefix(card_to_pack.get(choice)),
-                           del_prefix(choice),
-                           picked_count,
-                           not_picked_count + picked_count,
-                           pick_rate])
-
-    # Sort the results by pick rate in descending order
-    sorted_result = sorted(result, key=lambda x: float(x[5]), reverse=True)
-
-    insights = {
-        "Card Pick Rate": {
-            "description": "How often a card is picked when offered as a card reward",
-            "headers": ["Rarity", "Pack", "Card", "Picked", "Seen", "Pick Rate"],
-            "data": sorted_result
+        return insights
+
+
+def card_pick_rate(runs: Iterable[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
+    return run_insight(CardPickRate(CardCatalog(card_to_pack, card_to_rarity)), runs)
+
+
+# Pick rate of the cards offered in card rewards by floor, skipped rewards only add to the offered cards
+@reads("card_choices")
+class CardPickRateByFloor(Insight):
+    columnar = True
+    state_fields = ("floor_picks", "floor_offers")
+
+    def __init__(self):
+        self.floor_picks = Counter()
+        self.floor_offers = Counter()
+
+    def update(self, data_dict):
+        for choice in data_dict.get("card_choices", []):
+            floor = floor_of(choice.get("floor"))
+            picked = choice.get("picked")
+            if picked is not None and picked != "SKIP":
+                self.floor_picks[floor] += 1
+                self.floor_offers[floor] += 1
+            self.floor_offers[floor] += len(choice.get("not_picked", []))
+
+    def update_shard(self, store):
+        if not store.events or "card_choices" not in store.events:
+            return super().update_shard(store)
+        events = store.events["card_choices"]
+        offered = np.asarray(events["card"]) != store.interners["cards"].get("SKIP")
+        floors = np.asarray(events["floor"], dtype=np.int64)[offered]
+        picked = np.asarray(events["picked"])[offered] != 0
+        # Floors start at -1 (unknown), so they're shifted by one for bincount
+        offers = np.bincount(floors + 1)
+        picks = np.bincount(floors[picked] + 1, minlength=len(offers))
+        for floor in np.flatnonzero(offers).tolist():
+            self.floor_offers[floor - 1] += int(offers[floor])
+            if picks[floor]:
+                self.floor_picks[floor - 1] += int(picks[floor])
+
+    def finalize(self):
+        data = [[floor, self.floor_picks[floor], offers, make_ratio(self.floor_picks[floor], offers)]
+                for floor, offers in sorted(self.floor_offers.items()) if offers]
+
+        insights = {
+            "Card Pick Rate by Floor": {
+                "description": "How often an offered card is picked on each floor",
+                "headers": ["Floor", "Picked", "Seen", "Pick Rate"],
+                "data": data
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def card_pick_rate_by_floor(runs: Iterable[dict]) -> dict:
+    return run_insight(CardPickRateByFloor(), runs)
+
+
+# Highest ascension level, runs with a level outside of 0 to MAX_ASCENSION are counted in one extra bucket
+MAX_ASCENSION = 20
+_OTHER_ASCENSION = MAX_ASCENSION + 1
+_LEVELS = _OTHER_ASCENSION + 1
+
+
+# Dense wins/totals counts indexed by pack × ascension level that the win rate sheets by pack and ascension are all
+# derived from. Packs get their index in the order they're first seen, which keeps the rows in the order of the old
+# dict based sheets. Runs from a RunStore are counted with bincount over the (run, pack) pairs of its columns.
+# Like PackWinRate, a pack listed twice in currentPacks counts once for the run.
+class PackAscensionCube(Accumulator):
+    columnar = True
+    version = 2
+
+    def __init__(self):
+        self.packs = []
+        self.pack_index = {}
+        self.pack_wins = np.zeros((0, _LEVELS), dtype=np.int64)
+        self.pack_totals = np.zeros((0, _LEVELS), dtype=np.int64)
+        # Runs per ascension level, asc_decided only counts the runs that have a victory field
+        self.asc_wins = np.zeros(_LEVELS, dtype=np.int64)
+        self.asc_totals = np.zeros(_LEVELS, dtype=np.int64)
+        self.asc_decided = np.zeros(_LEVELS, dtype=np.int64)
+        # Runs given one by one are buffered and counted like a shard on the next flush
+        self._levels = []
+        self._victories = []
+        self._decided = []
+        self._pack_indices = []
+        self._pack_runs = []
+
+    def _pack(self, pack) -> int:
+        index = self.pack_index.get(pack)
+        if index is None:
+            index = self.pack_index[pack] = len(self.packs)
+            self.packs.append(pack)
+        return index
+
+    # Adds rows for packs that were added since the last count
+    def _grow(self):
+        missing = len(self.packs) - len(self.pack_totals)
+        if missing > 0:
+            self.pack_wins = np.pad(self.pack_wins, ((0, missing), (0, 0)))
+            self.pack_totals = np.pad(self.pack_totals, ((0, missing), (0, 0)))
+
+    # levels, victories and decided are per run, pack_indices and pack_runs hold the pack and run of every (run, pack)
+    def _count(self, levels, victories, decided, pack_indices, pack_runs):
+        self._grow()
+        self.asc_totals += np.bincount(levels, minlength=_LEVELS)
+        self.asc_wins += np.bincount(levels[victories], minlength=_LEVELS)
+        self.asc_decided += np.bincount(levels[decided], minlength=_LEVELS)
+
+        cells = pack_indices * _LEVELS + levels[pack_runs]
+        cube_size = len(self.packs) * _LEVELS
+        self.pack_totals += np.bincount(cells, minlength=cube_size).reshape(-1, _LEVELS)
+        self.pack_wins += np.bincount(cells[victories[pack_runs]], minlength=cube_size).reshape(-1, _LEVELS)
+
+    def update(self, run):
+        position = len(self._levels)
+        level = run.get('ascension_level', 0)
+        self._levels.append(level if type(level) is int and 0 <= level <= MAX_ASCENSION else _OTHER_ASCENSION)
+        self._victories.append(bool(run.get('victory', False)))
+        self._decided.append('victory' in run)
+        for pack in features_of(run).packs:
+            self._pack_indices.append(self._pack(pack))
+            self._pack_runs.append(position)
+
+        if position >= 65535:
+            self.flush()
+
+    def flush(self):
+        if self._levels:
+            self._count(np.array(self._levels, dtype=np.int64), np.array(self._victories, dtype=bool),
+                        np.array(self._decided, dtype=bool), np.array(self._pack_indices, dtype=np.int64),
+                        np.array(self._pack_runs, dtype=np.int64))
+            self._levels, self._victories, self._decided, self._pack_indices, self._pack_runs = [], [], [], [], []
+
+    def update_shard(self, store):
+        self.flush()
+        levels = store.columns["ascension_level"].astype(np.int64)
+        levels[(levels < 0) | (levels > MAX_ASCENSION)] = _OTHER_ASCENSION
+        victories = store.columns["victory"] != 0
+        decided = store.field_mask("victory")
+
+        values, pack_runs = pack_rows(store)
+
+        # Store ids are mapped to cube indices, packs the cube hasn't seen yet are added in the order they show up
+        names = store.interners["packs"].values
+        remap = np.full(len(names), -1, dtype=np.int64)
+        ids, first = np.unique(values, return_index=True)
+        for store_id in ids[np.argsort(first)].tolist():
+            remap[store_id] = self._pack(names[store_id])
+
+        self._count(levels, victories, decided, remap[values], pack_runs)
+
+    def state(self):
+        self.flush()
+        return {"packs": list(self.packs), "pack_wins": self.pack_wins, "pack_totals": self.pack_totals,
+                "asc_wins": self.asc_wins, "asc_totals": self.asc_totals, "asc_decided": self.asc_decided}
+
+    def merge(self, state):
+        self.flush()
+        indices = np.array([self._pack(pack) for pack in state["packs"]], dtype=np.int64)
+        self._grow()
+        self.pack_wins[indices] += state["pack_wins"]
+        self.pack_totals[indices] += state["pack_totals"]
+        self.asc_wins += state["asc_wins"]
+        self.asc_totals += state["asc_totals"]
+        self.asc_decided += state["asc_decided"]
+
+
+# Base of the insights derived from a PackAscensionCube, insights given the same cube share it
+class CubeInsight(Insight):
+    def __init__(self, cube: PackAscensionCube = None):
+        self.cube = cube if cube is not None else PackAscensionCube()
+        self.inputs = (self.cube,)
 
 
 # Create a dictionary to store wins and total runs per ascension level
-def count_win_rates_per_asc(runs: list[dict]) -> dict:
-    ascension_stats = {}
-    all_stats = {"wins": 0, "total_runs": 0}
+@reads("victory", "ascension_level")
+class WinRatesPerAsc(CubeInsight):
+    def finalize(self):
+        self.cube.flush()
+        wins = self.cube.asc_wins.tolist()
+        totals = self.cube.asc_decided.tolist()
+
+        insights = {
+            "Win Rate by Ascension Level": {
+                "description": "Win rate for each ascension level",
+                "headers": ["Ascension Level", "Won", "Total", "Win Rate"],
+                "data": []
+            }
+        }
 
-    for data_dict in runs:
-        if "victory" in data_dict:
-            ascension_level = data_dict.get("ascension_level", 0)
-            victory = data_dict["victory"]
+        # Overall win rate calculation
+        total_win_rate = make_ratio(sum(wins), sum(totals))
+        insights["Win Rate by Ascension Level"]["data"].append(
+            ["Overall", sum(wins), sum(totals), total_win_rate]
+        )
 
-            # Initialize the statistics for the ascension level if not already present
-            if ascension_level not in ascension_stats:
-                ascension_stats[ascension_level] = {"wins": 0, "total_runs": 0}
+        # Win rates per ascension level  (skipping ascs with less than 100 runs)
+        for ascension_level in range(MAX_ASCENSION + 1):
+            if totals[ascension_level] > 100:
+                win_rate = make_ratio(wins[ascension_level], totals[ascension_level])
+                insights["Win Rate by Ascension Level"]["data"].append([ascension_level, wins[ascension_level], totals[ascension_level], win_rate])
 
-            # Update statistics based on victory
-            ascension_stats[ascension_level]["total_runs"] += 1
-            all_stats["total_runs"] += 1
-            if victory:
-                ascension_stats[ascension_level]["wins"] += 1
-                all_stats["wins"] += 1
-
-    # Sort ascension levels in ascending order
-    sorted_ascension_levels = sorted(
-        (level for level in ascension_stats.keys() if 0 <= int(level) <= 20),
-        key=lambda x: int(x)
-    )
-
-    insights = {
-        "Win Rate by Ascension Level": {
-            "description": "Win rate for each ascension level",
-            "headers": ["Ascension Level", "Won", "Total", "Win Rate"],
-            "data": []
-        }
-    }
+        return insights
+
+
+def count_win_rates_per_asc(runs: Iterable[dict]) -> dict:
+    return run_insight(WinRatesPerAsc(), runs)
 
-    # Overall win rate calculation
-    total_win_rate = make_ratio(all_stats['wins'], all_stats['total_runs'])
-    insights["Win Rate by Ascension Level"]["data"].append(
-        ["Overall", all_stats['wins'], all_stats['total_runs'], total_win_rate]
-    )
 
-    # Win rates per ascension level  (skipping ascs with less than 100 runs)
-    for ascension_level in sorted_ascension_levels:
-        stats = ascension_stats[ascension_level]
-        if stats["total_runs"] > 100:
-            win_rate = make_ratio(stats["wins"], stats["total_runs"])
-            insights["Win Rate by Ascension Level"]["data"].append([ascension_level, stats["wins"], stats["total_runs"], win_rate])
+# Quantiles shown next to the medians
+QUANTILES = (0.25, 0.75, 0.9)
+QUANTILE_HEADERS = ["P25", "P75", "P90"]
 
-    return insights
 
+# Deck sizes are small integers, so they're counted in {size: runs} histograms that give the exact median
+@reads("victory", "ascension_level", "master_deck")
+class MedianDeckSizes(Insight):
+    state_fields = ("ascension_deck_sizes", "total_deck_sizes")
+    version = 2
 
-def median_deck_sizes(runs: list[dict]) -> dict:
-    # Create a dictionary to store deck sizes of victorious runs per ascension level
-    ascension_deck_sizes = {}
-    total_deck_sizes = []
+    def __init__(self):
+        # Create a dictionary to store deck size histograms of victorious runs per ascension level
+        self.ascension_deck_sizes = {}
+        self.total_deck_sizes = Counter()
 
-    for data_dict in runs:
+    def update(self, data_dict):
         # Check if the dictionary contains a "victory" key and it's True
         if data_dict.get("victory", False):
             ascension_level = data_dict.get("ascension_level", "Unknown")
             master_deck = data_dict.get("master_deck", [])
             deck_size = len(master_deck)
 
-            # Initialize the list for the ascension level if not already present
-            if ascension_level not in ascension_deck_sizes:
-                ascension_deck_sizes[ascension_level] = []
+            # Initialize the histogram for the ascension level if not already present
+            if ascension_level not in self.ascension_deck_sizes:
+                self.ascension_deck_sizes[ascension_level] = Counter()
+
+            self.ascension_deck_sizes[ascension_level][deck_size] += 1
+            self.total_deck_sizes[deck_size] += 1
+
+    def finalize(self):
+        # Sort ascension levels, handling "Unknown" by using a default value for sorting
+        sorted_ascension_levels = sorted(
+            self.ascension_deck_sizes.keys(),
+            key=lambda x: int(x) if x != "Unknown" else float("inf")
+        )
+
+        # Runs without any win (e.g. a small segment) have no deck sizes to take a median of
+        if self.total_deck_sizes:
+            data = [
+                ["Overall", histogram_median(self.total_deck_sizes)]
+                + [histogram_quantile(self.total_deck_sizes, q) for q in QUANTILES]
+            ]
+        else:
+            data = [["Overall", "N/A"] + ["N/A" for _ in QUANTILES]]
+        for ascension_level in sorted_ascension_levels:
+            deck_sizes = self.ascension_deck_sizes[ascension_level]
+            median_size = histogram_median(deck_sizes)
+            data.append([ascension_level, median_size] + [histogram_quantile(deck_sizes, q) for q in QUANTILES])
+
+        insights = {
+            "Median Deck Sizes": {
+                "description": "Median deck size of winning runs for each ascension level",
+                "headers": ["Ascension Level", "Median Deck Size"] + QUANTILE_HEADERS,
+                "data": data
+            }
+        }
 
-            ascension_deck_sizes[ascension_level].append(deck_size)
-            total_deck_sizes.append(deck_size)
+        return insights
 
-    # Sort ascension levels, handling "Unknown" by using a default value for sorting
-    sorted_ascension_levels = sorted(
-        ascension_deck_sizes.keys(),
-        key=lambda x: int(x) if x != "Unknown" else float("inf")
-    )
 
-    data = [
-        ["Overall", statistics.median(total_deck_sizes)]
-    ]
-    for ascension_level in sorted_ascension_levels:
-        median_size = statistics.median(ascension_deck_sizes[ascension_level])
-        data.append([ascension_level, median_size])
-
-    insights = {
-        "Median Deck Sizes": {
-            "description": "Median deck size of winning runs for each ascension level",
-            "headers": ["Ascension Level", "Median Deck Size"],
-            "data": data
-        }
-    }
+def median_deck_sizes(runs: Iterable[dict]) -> dict:
+    return run_insight(MedianDeckSizes(), runs)
 
-    return insights
 
+@reads("victory", "master_deck")
+class CardWinRate(CatalogInsight):
+    state_fields = ("card_stats",)
 
-def card_win_rate(runs: list[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
-    # Create a dictionary to store the number of wins and total runs for each card
-    card_stats = {}
+    def __init__(self, catalog: CardCatalog):
+        super().__init__(catalog)
+        # Create a dictionary to store the number of wins and total runs for each card id
+        self.card_stats = {}
 
-    for data_dict in runs:
+    def update(self, data_dict):
         # Check if the dictionary contains both "master_deck" and "victory" keys
         if "master_deck" in data_dict and "victory" in data_dict:
-            master_deck = [card.split('+')[0] for card in data_dict['master_deck']]
+            lookup = self.catalog.lookup
+            card_stats = self.card_stats
             victory = data_dict["victory"]
 
-            for card in master_deck:
-                if card not in card_stats:
-                    card_stats[card] = {"wins": 0, "total_runs": 0}
+            for card in features_of(data_dict).deck:
+                card_id = lookup(card).card_id
+                if card_id not in card_stats:
+                    card_stats[card_id] = {"wins": 0, "total_runs": 0}
 
                 # Update statistics based on victory
-                card_stats[card]["total_runs"] += 1
+                card_stats[card_id]["total_runs"] += 1
                 if victory:
-                    card_stats[card]["wins"] += 1
+                    card_stats[card_id]["wins"] += 1
+
+    def finalize(self):
+        catalog = self.catalog
+        sorted_card_stats = sorted(self.card_stats.items(),
+                                   key=lambda x: (x[1]["wins"] / x[1]["total_runs"] if x[1]["total_runs"] > 0 else 0.0),
+                                   reverse=True)
+
+        data = []
+
+        for card_id, stats in sorted_card_stats:
+            if catalog.card_pack[card_id] >= 0 and stats["total_runs"] >= 50:
+                total_runs = stats["total_runs"]
+                win_rate = f"{(stats['wins'] / total_runs) * 100:.2f}" if total_runs > 0 else "N/A"
+                data.append([catalog.rarity_of(card_id),
+                             del_prefix(catalog.pack_of(card_id)),
+                             del_prefix(catalog.cards[card_id]),
+                             stats['wins'],
+                             total_runs,
+                             win_rate])
+
+        # Return the insights data structure
+        insights = {
+            "Win Rate by Card": {
+                "description": "Win rate for each card",
+                "headers": ["Rarity", "Pack", "Card", "Wins", "Total", "Win Rate"],
+                "data": data
+            }
+        }
 
-    sorted_card_stats = sorted(card_stats.items(),
-                               key=lambda x: (x[1]["wins"] / x[1]["total_runs"] if x[1]["total_runs"] > 0 else 0.0),
-                               reverse=True)
+        return insights
 
-    data = []
 
-    for card, stats in sorted_card_stats:
-        if card_to_pack.get(card) and stats["total_runs"] >= 50:
-            total_runs = stats["total_runs"]
-            win_rate = f"{(stats['wins'] / total_runs) * 100:.2f}" if total_runs > 0 else "N/A"
-            data.append([card_to_rarity.get(card, "Unknown"),
-                         del_prefix(card_to_pack.get(card)),
-                         del_prefix(card),
-                         stats['wins'],
-                         total_runs,
-                         win_rate])
-
-    # Return the insights data structure
-    insights = {
-        "Win Rate by Card": {
-            "description": "Win rate for each card",
-            "headers": ["Rarity", "Pack", "Card", "Wins", "Total", "Win Rate"],
-            "data": data
-        }
-    }
-
-    return insights
+def card_win_rate(runs: Iterable[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
+    return run_insight(CardWinRate(CardCatalog(card_to_pack, card_to_rarity)), runs)
 
 
 # This is bogus data for fun
-def hat_win_rate(runs: list[dict]) -> dict:
-    # Create a dictionary to store the number of wins and total runs for each pickedHat
-    picked_hat_stats = {}
+@reads("victory", "pickedHat")
+class HatWinRate(Insight):
+    state_fields = ("picked_hat_stats",)
+
+    def __init__(self):
+        # Create a dictionary to store the number of wins and total runs for each pickedHat
+        self.picked_hat_stats = {}
 
-    for data_dict in runs:
+    def update(self, data_dict):
         # Check if the dictionary contains both "pickedHat" and "victory" keys
         if "pickedHat" in data_dict and "victory" in data_dict:
             picked_hat = data_dict["pickedHat"]
             victory = data_dict["victory"]
 
             # Initialize the pickedHat's statistics if not already present
-            if picked_hat not in picked_hat_stats:
-                picked_hat_stats[picked_hat] = {"wins": 0, "total_runs": 0}
+            if picked_hat not in self.picked_hat_stats:
+                self.picked_hat_stats[picked_hat] = {"wins": 0, "total_runs": 0}
 
             # Update statistics based on victory
-            picked_hat_stats[picked_hat]["total_runs"] += 1
+            self.picked_hat_stats[picked_hat]["total_runs"] += 1
             if victory:
-                picked_hat_stats[picked_hat]["wins"] += 1
+                self.picked_hat_stats[picked_hat]["wins"] += 1
 
-    sorted_results = sorted(picked_hat_stats.items(),
-                            key=lambda x: (x[1]["wins"] / x[1]["total_runs"] if x[1]["total_runs"] > 0 else 0.0),
-                            reverse=True)
+    def finalize(self):
+        sorted_results = sorted(self.picked_hat_stats.items(),
+                                key=lambda x: (x[1]["wins"] / x[1]["total_runs"] if x[1]["total_runs"] > 0 else 0.0),
+                                reverse=True)
 
-    data = []
+        data = []
 
-    for picked_hat, stats in sorted_results:
-        wins = stats["wins"]
-        total_runs = stats["total_runs"]
-        win_rate = make_ratio(wins, total_runs)
-        data.append([del_prefix(picked_hat), wins, total_runs, win_rate])
+        for picked_hat, stats in sorted_results:
+            wins = stats["wins"]
+            total_runs = stats["total_runs"]
+            win_rate = make_ratio(wins, total_runs)
+            data.append([del_prefix(picked_hat), wins, total_runs, win_rate])
 
-    sorted_data = sorted(data, key=lambda x: x[3], reverse=True)
+        sorted_data = sorted(data, key=lambda x: x[3], reverse=True)
 
-    insights = {
-        "Hat Win Rate": {
-            "description": "Win Rate based on what hat was picked (this is bogus data)",
-            "headers": ["Picked Hat", "Wins", "Total", "Win Rate"],
-            "data": sorted_data
+        insights = {
+            "Hat Win Rate": {
+                "description": "Win Rate based on what hat was picked (this is bogus data)",
+                "headers": ["Picked Hat", "Wins", "Total", "Win Rate"],
+                "data": sorted_data
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def hat_win_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(HatWinRate(), runs)
 
 
-def median_turn_length_per_enemy(runs: list[dict]) -> dict:
-    # Create a dictionary to store the turn lengths for each enemy
-    enemy_turn_lengths = {}
+# Turn counts are small integers as well, every enemy gets a {turns: fights} histogram
+@reads("damage_taken")
+class TurnLengthPerEnemy(Insight):
+    columnar = True
+    state_fields = ("enemy_turn_lengths",)
+    version = 2
 
-    for data_dict in runs:
+    def __init__(self):
+        # Create a dictionary to store the turn length histogram for each enemy
+        self.enemy_turn_lengths = {}
+
+    def update(self, data_dict):
         # Check if the dictionary contains the "damage_taken" key
         if "damage_taken" in data_dict:
             damage_taken = data_dict["damage_taken"]
@@ -438,469 +793,968 @@ def median_turn_length_per_enemy(runs: list[dict]) -> dict:
                 enemy = entry.get("enemies", "")
                 turns = entry.get("turns", 0)
 
-                # Initialize the enemy's turn lengths list if not already present
-                if enemy not in enemy_turn_lengths:
-                    enemy_turn_lengths[enemy] = []
-
-                # Append the turn length to the enemy's list
-                enemy_turn_lengths[enemy].append(turns)
-
-    sorted_results = sorted(
-        enemy_turn_lengths.items(),
-        key=lambda x: statistics.median(x[1]),
-        reverse=True, )
+                # Initialize the enemy's turn length histogram if not already present
+                if enemy not in self.enemy_turn_lengths:
+                    self.enemy_turn_lengths[enemy] = Counter()
+
+                # Count the turn length in the enemy's histogram
+                self.enemy_turn_lengths[enemy][turns] += 1
+
+    # Histograms of the (enemy, turns) pairs of the fight table, enemies are added in the order they first show up
+    def update_shard(self, store):
+        if not store.events or "fights" not in store.events:
+            return super().update_shard(store)
+        fights = store.events["fights"]
+        enemies = np.asarray(fights["enemy"], dtype=np.int64)
+        turns = np.asarray(fights["turns"], dtype=np.int64)
+        if len(enemies) == 0:
+            return
+
+        # Turns are shifted to be non negative, so every pair gets its own key
+        low = int(turns.min())
+        width = int(turns.max()) - low + 1
+        keys, first, counts = np.unique(enemies * width + (turns - low), return_index=True, return_counts=True)
+        names = store.interners["enemies"].values
+        for position in np.argsort(first, kind='stable').tolist():
+            enemy, turn = divmod(int(keys[position]), width)
+            histogram = self.enemy_turn_lengths.get(names[enemy])
+            if histogram is None:
+                histogram = self.enemy_turn_lengths[names[enemy]] = Counter()
+            histogram[turn + low] += int(counts[position])
+
+    def finalize(self):
+        # The median of every enemy is computed once instead of in the sort key
+        medians = {enemy: histogram_median(turn_lengths) for enemy, turn_lengths in self.enemy_turn_lengths.items()}
+        sorted_results = sorted(
+            self.enemy_turn_lengths.items(),
+            key=lambda x: medians[x[0]],
+            reverse=True, )
+
+        insights = {
+            "Turn Length": {
+                "description": "Median turn length for each enemy",
+                "headers": ["Enemy", "Median Turn Length", "Number of Fights"] + QUANTILE_HEADERS,
+                "data": []
+            }
+        }
 
-    insights = {
-        "Turn Length": {
-            "description": "Median turn length for each enemy",
-            "headers": ["Enemy", "Median Turn Length", "Number of Fights"],
-            "data": []
+        # Populate data for each enemy
+        for enemy, turn_lengths in sorted_results:
+            insights["Turn Length"]["data"].append(
+                [enemy, medians[enemy], sum(turn_lengths.values())]
+                + [histogram_quantile(turn_lengths, q) for q in QUANTILES])
+
+        return insights
+
+
+def median_turn_length_per_enemy(runs: Iterable[dict]) -> dict:
+    return run_insight(TurnLengthPerEnemy(), runs)
+
+
+# Average damage taken per enemy, split by act (by="act") or by ascension level (by="ascension")
+@reads("ascension_level", "damage_taken")
+class DamageTakenPerEnemy(Insight):
+    columnar = True
+    state_fields = ("fight_counts", "damage_sums")
+
+    def __init__(self, by: str = "act"):
+        if by not in ("act", "ascension"):
+            raise ValueError(f"Can't split the damage by {by}, use act or ascension.")
+        self.by = by
+        # (enemy, act or ascension) -> fights and summed damage
+        self.fight_counts = Counter()
+        self.damage_sums = Counter()
+
+    def fresh(self):
+        return type(self)(self.by)
+
+    # The split goes before the version, partials of other versions are removed by that prefix (see RunCache.save_partial)
+    @property
+    def partial_name(self) -> str:
+        return f"{type(self).__name__}-{self.by}.v{self.version}"
+
+    def update(self, data_dict):
+        ascension = data_dict.get("ascension_level", 0)
+        for entry in data_dict.get("damage_taken", []):
+            split = act_of(floor_of(entry.get("floor"))) if self.by == "act" else ascension
+            key = (entry.get("enemies", ""), split)
+            self.fight_counts[key] += 1
+            self.damage_sums[key] += entry.get("damage", 0)
+
+    def update_shard(self, store):
+        if not store.events or "fights" not in store.events:
+            return super().update_shard(store)
+        fights = store.events["fights"]
+        runs = np.asarray(fights["run"], dtype=np.int64)
+        if self.by == "act":
+            splits = act_of(np.asarray(fights["floor"], dtype=np.int64))
+        else:
+            splits = np.asarray(store.columns["ascension_level"], dtype=np.int64)[runs]
+
+        # Grouped by (enemy, split) with one unique over the pair keys
+        low = int(splits.min()) if len(splits) else 0
+        width = int(splits.max()) - low + 1 if len(splits) else 1
+        keys, first, inverse, counts = np.unique(np.asarray(fights["enemy"], dtype=np.int64) * width + (splits - low),
+                                                 return_index=True, return_inverse=True, return_counts=True)
+        damage = np.bincount(inverse.ravel(), weights=fights["damage"], minlength=len(keys))
+        names = store.interners["enemies"].values
+        for position in np.argsort(first, kind='stable').tolist():
+            enemy, split = divmod(int(keys[position]), width)
+            key = (names[enemy], split + low)
+            self.fight_counts[key] += int(counts[position])
+            self.damage_sums[key] += float(damage[position])
+
+    def finalize(self):
+        rows = []
+        for (enemy, split), fights in self.fight_counts.items():
+            rows.append([enemy, split, fights, f"{self.damage_sums[(enemy, split)] / fights:.2f}"])
+        rows.sort(key=lambda row: (row[0], row[1]))
+
+        split_name = "Act" if self.by == "act" else "Ascension Level"
+        insights = {
+            f"Damage Taken by Enemy and {split_name}": {
+                "description": f"Average damage taken in fights against each enemy by {split_name.lower()}",
+                "headers": ["Enemy", split_name, "Fights", "Average Damage"],
+                "data": rows
+            }
         }
-    }
 
-    # Populate data for each enemy
-    for enemy, turn_lengths in sorted_results:
-        median_turn_length = statistics.median(turn_lengths)
-        insights["Turn Length"]["data"].append(
-            [enemy, median_turn_length, len(turn_lengths)])
+        return insights
 
-    return insights
 
+def damage_taken_per_enemy(runs: Iterable[dict], by: str = "act") -> dict:
+    return run_insight(DamageTakenPerEnemy(by), runs)
 
-def _count_upgraded_cards(runs: list[dict]) -> dict:
-    card_upgrade_counts = defaultdict(int)
 
-    for run in runs:
-        for choice in run.get("campfire_choices", []):
-            if choice["key"] == "SMITH":
-                card_name = del_prefix(choice["data"])
-                card_upgrade_counts[card_name] += 1
+def _count_upgraded_cards(runs: Iterable[dict]) -> dict:
+    # Same counts UpgradedCardWinRate collects, the catalog is only used to strip upgrades
+    counts = UpgradedCardWinRate(CardCatalog({}, {}))
+    run_insight(counts, runs)
 
     # Sort the cards by their upgrade frequency
-    sorted_upgrade_counts = dict(sorted(card_upgrade_counts.items(), key=lambda item: item[1], reverse=True))
+    sorted_upgrade_counts = dict(sorted(counts.upgrade_total_counts.items(), key=lambda item: item[1], reverse=True))
 
     return sorted_upgrade_counts
 
 
-def upgraded_card_win_rate_analysis(runs: list[dict], card_to_pack: dict) -> dict:
-    frequently_upgraded = _count_upgraded_cards(runs)
+@reads("victory", "master_deck", "campfire_choices")
+class UpgradedCardWinRate(Insight):
+    columnar = True
+    # Counted by card name, the catalog is only used to strip the upgrades
+    state_fields = ("upgrade_win_counts", "upgrade_total_counts", "card_win_counts", "card_total_counts")
+
+    def __init__(self, catalog: CardCatalog):
+        self.catalog = catalog
+
+        # Count the number of runs where the card was upgraded and won
+        self.upgrade_win_counts = defaultdict(int)
+        self.upgrade_total_counts = defaultdict(int)
 
-    # Count the number of runs where the card was upgraded and won
-    upgrade_win_counts = defaultdict(int)
-    upgrade_total_counts = defaultdict(int)
+        # Count the number of runs where the card was present and won
+        self.card_win_counts = defaultdict(int)
+        self.card_total_counts = defaultdict(int)
 
-    # Count the number of runs where the card was present and won
-    card_win_counts = defaultdict(int)
-    card_total_counts = defaultdict(int)
+    def fresh(self):
+        return type(self)(self.catalog)
 
-    for run in runs:
-        cards = [del_prefix(del_upg(card)) for card in run['master_deck']]
-        upgraded_cards = [del_prefix(choice["data"]) for choice in run.get("campfire_choices", []) if
-                          choice["key"] == "SMITH"]
+    def update(self, run):
+        lookup = self.catalog.lookup
+        features = features_of(run)
+        cards = [lookup(card).name for card in features.deck]
+        upgraded_cards = [del_prefix(card) for card in features.smith_targets]
 
         for card in cards:
-            card_total_counts[card] += 1
+            self.card_total_counts[card] += 1
             if run.get('victory', False):
-                card_win_counts[card] += 1
+                self.card_win_counts[card] += 1
 
         for upgraded_card in upgraded_cards:
-            upgrade_total_counts[upgraded_card] += 1
+            self.upgrade_total_counts[upgraded_card] += 1
             if run.get('victory', False):
-                upgrade_win_counts[upgraded_card] += 1
-
-    insights = {
-        "Card Upgrades": {
-            "description": "Card upgrade frequencies and effect on win rate",
-            "headers": ["Card", "Amount Upgraded", "Win Rate when Upgraded", "Overall Card Win Rate","Change When Upgraded"],
-            "data": []
+                self.upgrade_win_counts[upgraded_card] += 1
+
+    def update_shard(self, store):
+        events = _campfire_events(store)
+        if events is None or store.features is None:
+            return super().update_shard(store)
+        victory = store.index.victory.mask()
+        names = store.interners["cards"].values
+
+        # Deck cards by interned id, several ids can share a name once the prefix is gone
+        offsets = store.features["deck.offsets"]
+        deck = np.asarray(store.features["deck.values"], dtype=np.int64)
+        deck_wins = victory[np.repeat(np.arange(len(store)), np.diff(offsets))]
+        totals = np.bincount(deck)
+        wins = np.bincount(deck[deck_wins], minlength=len(totals))
+        for card_id in np.flatnonzero(totals).tolist():
+            name = del_prefix(names[card_id])
+            self.card_total_counts[name] += int(totals[card_id])
+            if wins[card_id]:
+                self.card_win_counts[name] += int(wins[card_id])
+
+        # Smith targets by (card, upgrade), in the order they're first upgraded
+        smiths = events["action"] == ACTION_CODES["SMITH"]
+        cards = events["card"][smiths].astype(np.int64)
+        upgrades = events["upgrade"][smiths].astype(np.int64)
+        smith_wins = victory[events["run"][smiths]]
+        if len(cards) == 0:
+            return
+        width = int(upgrades.max()) + 1
+        keys, first, inverse = np.unique(cards * width + upgrades, return_index=True, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), minlength=len(keys))
+        wins = np.bincount(inverse.ravel()[smith_wins], minlength=len(keys))
+        for position in np.argsort(first, kind='stable').tolist():
+            card_id, upgrade = divmod(int(keys[position]), width)
+            name = del_prefix(names[card_id]) + (f"+{upgrade}" if upgrade else "")
+            self.upgrade_total_counts[name] += int(totals[position])
+            if wins[position]:
+                self.upgrade_win_counts[name] += int(wins[position])
+
+    def finalize(self):
+        # Same counts as _count_upgraded_cards, taken from this pass so the runs are only read once
+        frequently_upgraded = self.upgrade_total_counts
+
+        insights = {
+            "Card Upgrades": {
+                "description": "Card upgrade frequencies and effect on win rate",
+                "headers": ["Card", "Amount Upgraded", "Win Rate when Upgraded", "Overall Card Win Rate","Change When Upgraded"],
+                "data": []
+            }
         }
-    }
 
-    sorted_analysis = dict(sorted(frequently_upgraded.items(), key=lambda item: item[1], reverse=True))
+        sorted_analysis = dict(sorted(frequently_upgraded.items(), key=lambda item: item[1], reverse=True))
+
+        for card, freq in sorted_analysis.items():
+            if freq < 350:
+                continue
+
+            # The general winrate for multi upgrades was showing as 0, this just makes it display the base card's winrate
+            base_card = re.sub(r'\+\d+$', '', card)
 
-    for card, freq in sorted_analysis.items():
-        if freq < 350:
-            continue
+            upgrade_win_rate = make_ratio(self.upgrade_win_counts[card], self.upgrade_total_counts[card])
+            general_win_rate = make_ratio(self.card_win_counts[base_card], self.card_total_counts[base_card])
 
-        # The general winrate for multi upgrades was showing as 0, this just makes it display the base card's winrate
-        base_card = re.sub(r'\+\d+$', '', card)
+            win_rate_diff = float(upgrade_win_rate) - float(general_win_rate)
+            formatted_diff = f"+{win_rate_diff:.2f}" if win_rate_diff > 0 else f"{win_rate_diff:.2f}"
 
-        upgrade_win_rate = make_ratio(upgrade_win_counts[card], upgrade_total_counts[card])
-        general_win_rate = make_ratio(card_win_counts[base_card], card_total_counts[base_card])
+            insights["Card Upgrades"]["data"].append([del_prefix(card), freq, upgrade_win_rate, general_win_rate,formatted_diff])
 
-        win_rate_diff = float(upgrade_win_rate) - float(general_win_rate)
-        formatted_diff = f"+{win_rate_diff:.2f}" if win_rate_diff > 0 else f"{win_rate_diff:.2f}"
-    
-        insights["Card Upgrades"]["data"].append([del_prefix(card), freq, upgrade_win_rate, general_win_rate,formatted_diff])
+        return insights
 
-    return insights
 
+def upgraded_card_win_rate_analysis(runs: Iterable[dict], card_to_pack: dict) -> dict:
+    return run_insight(UpgradedCardWinRate(CardCatalog(card_to_pack, {})), runs)
 
-def median_health_before_rest(runs: list[dict]) -> dict:
-    # Dictionary to hold health values for each ascension level
-    ascension_healths = defaultdict(list)
-    overall_health_ratios = []  # Track health ratios across all ascensions
 
-    for run in runs:
+# HP ratios are counted in quantile sketches, the medians are exact until a sketch holds more distinct ratios than its
+# exact limit and off by at most half a sketch bin (0.0005 HP%) after that
+@reads("ascension_level", "campfire_choices", "current_hp_per_floor", "max_hp_per_floor")
+class HealthBeforeRest(Insight):
+    columnar = True
+    state_fields = ("ascension_healths", "overall_health_ratios")
+    version = 3
+
+    def __init__(self):
+        # Dictionary to hold a health ratio sketch for each ascension level
+        self.ascension_healths = defaultdict(QuantileSketch)
+        self.overall_health_ratios = QuantileSketch()  # Track health ratios across all ascensions
+
+    def update(self, run):
         ascension = run['ascension_level']
-        for choice in run['campfire_choices']:
-            if choice['key'] == 'REST':
-                floor_index = int(choice['floor'])
-                if len(run['current_hp_per_floor']) > floor_index and len(run['max_hp_per_floor']) > floor_index:
-                    current_health = run['current_hp_per_floor'][floor_index]
-                    max_health = run['max_hp_per_floor'][floor_index]
-                    health_ratio = current_health / max_health if max_health > 0 else 0
-                    ascension_healths[ascension].append(health_ratio)
-                    overall_health_ratios.append(health_ratio)
-
-    # Compute median health ratio for each ascension
-    median_healths = {ascension: statistics.median(health_ratios) for ascension, health_ratios in
-                      ascension_healths.items()}
-
-    # Compute and print overall median
-    overall_median = statistics.median(overall_health_ratios) * 100
-
-    data = [["Overall", f"{overall_median:.2f}"]]
-    
-    valid_ascensions = [asc for asc in median_healths.keys() if 0 <= int(asc) <= 20]
-    for ascension in sorted(valid_ascensions, key=lambda x: int(x), reverse=True):
-        health_ratio = median_healths[ascension] * 100
-        data.append([ascension, f"{health_ratio:.2f}"])
-
-    # Create insights structure
-    insights = {
-        "Health Before Rest": {
-            "description": "Median HP% before rest across different ascension levels",
-            "headers": ["Ascension Level", "Median HP% Before Rest"],
-            "data": data
+        for floor_index in features_of(run).rest_floors:
+            if len(run['current_hp_per_floor']) > floor_index and len(run['max_hp_per_floor']) > floor_index:
+                current_health = run['current_hp_per_floor'][floor_index]
+                max_health = run['max_hp_per_floor'][floor_index]
+                health_ratio = current_health / max_health if max_health > 0 else 0
+                self.ascension_healths[ascension].add(health_ratio)
+                self.overall_health_ratios.add(health_ratio)
+
+    # The HP of every rest is joined into the campfire table, the ratios go into the sketches per ascension at once
+    def update_shard(self, store):
+        events = _campfire_events(store)
+        if events is None:
+            return super().update_shard(store)
+        rests = (events["action"] == ACTION_CODES["REST"]) & (events["hp"] >= 0) & (events["max_hp"] >= 0)
+        current_health = events["hp"][rests].astype(np.float64)
+        max_health = events["max_hp"][rests].astype(np.float64)
+        ratios = np.divide(current_health, max_health, out=np.zeros_like(current_health), where=max_health > 0)
+        ascensions = np.asarray(store.columns["ascension_level"], dtype=np.int64)[events["run"][rests]]
+
+        self.overall_health_ratios.add_many(ratios)
+        for ascension in np.unique(ascensions).tolist():
+            self.ascension_healths[ascension].add_many(ratios[ascensions == ascension])
+
+    def finalize(self):
+        # Compute median health ratio for each ascension
+        median_healths = {ascension: health_ratios.median() for ascension, health_ratios in
+                          self.ascension_healths.items()}
+
+        # Compute and print overall median, runs without any rest (e.g. a small segment) have none
+        if len(self.overall_health_ratios):
+            overall_median = self.overall_health_ratios.median() * 100
+            data = [["Overall", f"{overall_median:.2f}"]
+                    + [f"{self.overall_health_ratios.quantile(q) * 100:.2f}" for q in QUANTILES]]
+        else:
+            data = [["Overall", "N/A"] + ["N/A" for _ in QUANTILES]]
+
+        valid_ascensions = [asc for asc in median_healths.keys() if 0 <= int(asc) <= 20]
+        for ascension in sorted(valid_ascensions, key=lambda x: int(x), reverse=True):
+            health_ratio = median_healths[ascension] * 100
+            sketch = self.ascension_healths[ascension]
+            data.append([ascension, f"{health_ratio:.2f}"] + [f"{sketch.quantile(q) * 100:.2f}" for q in QUANTILES])
+
+        # Create insights structure
+        insights = {
+            "Health Before Rest": {
+                "description": "Median HP% before rest across different ascension levels",
+                "headers": ["Ascension Level", "Median HP% Before Rest"] + QUANTILE_HEADERS,
+                "data": data
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def median_health_before_rest(runs: Iterable[dict]) -> dict:
+    return run_insight(HealthBeforeRest(), runs)
+
+
+# Floors of the HP curves, floors past that are left out
+MAX_FLOORS = 64
+# Whole HP percents from 0 to 100
+_HP_BINS = 101
+HP_CURVE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+# Pads the ragged per floor values of the runs into a (runs, width) matrix, missing floors are -1
+def _floor_matrix(offsets, values, size, width):
+    lengths = np.diff(offsets)
+    matrix = np.full((size, width), -1, dtype=np.int32)
+    rows = np.repeat(np.arange(size), lengths)
+    matrix[rows, np.arange(len(values)) - np.repeat(offsets[:-1], lengths)] = values
+    return matrix
+
+
+# Percentiles of the HP% on every floor for winning and losing runs by ascension level. Every (result, ascension,
+# floor) has a histogram of whole HP percents, the percentiles are exact up to that rounding.
+@reads("victory", "ascension_level", "current_hp_per_floor", "max_hp_per_floor")
+class HPCurvePercentiles(Insight):
+    columnar = True
+
+    def __init__(self):
+        self.counts = np.zeros((2, _LEVELS, MAX_FLOORS, _HP_BINS), dtype=np.int64)
+        # Runs given one by one are buffered and counted like a shard on the next flush
+        self._won = []
+        self._levels = []
+        self._current = []
+        self._current_offsets = [0]
+        self._maximum = []
+        self._max_offsets = [0]
+
+    # won and levels are per run, current and maximum the (runs, floors) HP matrices
+    def _count(self, won, levels, current, maximum):
+        floors = min(current.shape[1], MAX_FLOORS)
+        current, maximum = current[:, :floors], maximum[:, :floors]
+        valid = (current >= 0) & (maximum > 0)
+        percents = np.clip(np.rint(current / np.where(valid, maximum, 1) * 100), 0, 100).astype(np.int64)
+        cells = ((won.astype(np.int64)[:, None] * _LEVELS + levels[:, None]) * MAX_FLOORS + np.arange(floors)) * _HP_BINS + percents
+        self.counts += np.bincount(cells[valid], minlength=self.counts.size).reshape(self.counts.shape)
+
+    # Counts the HP lists of two offsets/values pairs like a shard
+    def _count_lists(self, won, levels, current_offsets, current, max_offsets, maximum):
+        size = len(levels)
+        width = int(max(np.diff(current_offsets).max(initial=0), np.diff(max_offsets).max(initial=0)))
+        self._count(won, levels, _floor_matrix(current_offsets, current, size, width),
+                    _floor_matrix(max_offsets, maximum, size, width))
+
+    def update(self, run):
+        level = run.get('ascension_level', 0)
+        self._levels.append(level if type(level) is int and 0 <= level <= MAX_ASCENSION else _OTHER_ASCENSION)
+        self._won.append(bool(run.get("victory", False)))
+        self._current.extend(run.get("current_hp_per_floor") or [])
+        self._current_offsets.append(len(self._current))
+        self._maximum.extend(run.get("max_hp_per_floor") or [])
+        self._max_offsets.append(len(self._maximum))
+
+        if len(self._levels) >= 4096:
+            self.flush()
+
+    def flush(self):
+        if self._levels:
+            self._count_lists(np.array(self._won, dtype=bool), np.array(self._levels, dtype=np.int64),
+                              np.array(self._current_offsets, dtype=np.int64), np.array(self._current, dtype=np.int64),
+                              np.array(self._max_offsets, dtype=np.int64), np.array(self._maximum, dtype=np.int64))
+            self._won, self._levels, self._current, self._maximum = [], [], [], []
+            self._current_offsets, self._max_offsets = [0], [0]
+
+    def update_shard(self, store):
+        self.flush()
+        levels = store.columns["ascension_level"].astype(np.int64)
+        levels[(levels < 0) | (levels > MAX_ASCENSION)] = _OTHER_ASCENSION
+        self._count_lists(store.index.victory.mask(), levels,
+                          store.columns["current_hp_per_floor.offsets"], store.columns["current_hp_per_floor.values"],
+                          store.columns["max_hp_per_floor.offsets"], store.columns["max_hp_per_floor.values"])
+
+        # Runs whose HP lists didn't fit the columns are in the extras
+        for index in np.flatnonzero(~(store.field_mask("current_hp_per_floor") & store.field_mask("max_hp_per_floor"))).tolist():
+            run = store.extras[index]
+            if "current_hp_per_floor" in run or "max_hp_per_floor" in run:
+                self.update(store[index])
+
+    # Only the filled cells are saved
+    def state(self):
+        self.flush()
+        cells = np.flatnonzero(self.counts)
+        return {"cells": cells, "counts": self.counts.reshape(-1)[cells]}
+
+    def merge(self, state):
+        self.flush()
+        np.add.at(self.counts.reshape(-1), state["cells"], state["counts"])
+
+    # Percentile q of every histogram along the last axis, interpolated like histogram_quantile
+    @staticmethod
+    def _quantiles(histograms, q):
+        totals = histograms.sum(axis=-1)
+        cumulative = histograms.cumsum(axis=-1)
+        position = q * np.maximum(totals - 1, 0)
+        rank = np.floor(position)
+        upper_rank = np.minimum(rank + 1, np.maximum(totals - 1, 0))
+        lower = (cumulative > rank[..., None]).argmax(axis=-1)
+        upper = (cumulative > upper_rank[..., None]).argmax(axis=-1)
+        return lower + (upper - lower) * (position - rank)
+
+    def finalize(self):
+        self.flush()
+        runs = self.counts.sum(axis=-1)
+        quantiles = [self._quantiles(self.counts, q) for q in HP_CURVE_QUANTILES]
+
+        data = []
+        for level in range(MAX_ASCENSION, -1, -1):
+            for floor in range(MAX_FLOORS):
+                for won, result in ((1, "Won"), (0, "Lost")):
+                    if runs[won, level, floor]:
+                        data.append([level, floor + 1, result, int(runs[won, level, floor])]
+                                    + [f"{values[won, level, floor]:.2f}" for values in quantiles])
+
+        insights = {
+            "HP Curve Percentiles": {
+                "description": "HP% percentiles on every floor of winning and losing runs for each ascension level",
+                "headers": ["Ascension Level", "Floor", "Result", "Runs", "P10", "P25", "Median", "P75", "P90"],
+                "data": data
+            }
+        }
+
+        return insights
+
 
+def hp_curve_percentiles(runs: Iterable[dict]) -> dict:
+    return run_insight(HPCurvePercentiles(), runs)
 
-def smith_vs_rest_ratio(runs: list[dict]) -> dict:
-    # Dictionary to hold count of 'SMITH' and 'REST' choices for each ascension level
-    ascension_choices = defaultdict(lambda: {'SMITH': 0, 'REST': 0})
-    overall_choices = {'SMITH': 0, 'REST': 0}  # Track overall 'SMITH' and 'REST' choices
 
-    for run in runs:
+# Module level instead of a lambda, so the insight can be pickled for the insight workers
+def _campfire_counts():
+    return {'SMITH': 0, 'REST': 0}
+
+
+@reads("ascension_level", "campfire_choices")
+class SmithVsRest(Insight):
+    columnar = True
+    state_fields = ("ascension_choices", "overall_choices")
+
+    def __init__(self):
+        # Dictionary to hold count of 'SMITH' and 'REST' choices for each ascension level
+        self.ascension_choices = defaultdict(_campfire_counts)
+        self.overall_choices = {'SMITH': 0, 'REST': 0}  # Track overall 'SMITH' and 'REST' choices
+
+    def update(self, run):
         ascension = run['ascension_level']
-        for choice in run['campfire_choices']:
-            if choice['key'] in ['SMITH', 'REST']:
-                ascension_choices[ascension][choice['key']] += 1
-                overall_choices[choice['key']] += 1
-
-    # Compute and print overall ratio
-    overall_ratio = overall_choices['SMITH'] / overall_choices['REST'] if overall_choices['REST'] > 0 else 0
-
-    data = [["Overall", overall_choices['SMITH'], overall_choices['REST'], f"{overall_ratio:.2f}"]]
-
-    valid_ascensions = [asc for asc in ascension_choices.keys() if 0 <= int(asc) <= 20]
-    for ascension in sorted(valid_ascensions, key=lambda x: int(x), reverse=True):
-        choices = ascension_choices[ascension]
-        if (choices['SMITH'] + choices['REST']) > 100:  # Only show ascs with a combined total of 100+ picked
-            ratio = choices['SMITH'] / choices['REST'] if choices['REST'] > 0 else 0
-            data.append([ascension, choices['SMITH'], choices['REST'], f"{ratio:.2f}"])
-
-    # Format into the insights structure
-    insights = {
-        "Smith Vs Rest": {
-            "description": "Smith-to-rest ratio at campsites",
-            "headers": ["Ascension Level", "Number of Smiths", "Number of Rests", "Smith-to-Rest Ratio"],
-            "data": data
+        features = features_of(run)
+        smiths, rests = len(features.smith_targets), len(features.rest_floors)
+        if smiths or rests:
+            self.ascension_choices[ascension]['SMITH'] += smiths
+            self.ascension_choices[ascension]['REST'] += rests
+            self.overall_choices['SMITH'] += smiths
+            self.overall_choices['REST'] += rests
+
+    def update_shard(self, store):
+        events = _campfire_events(store)
+        if events is None:
+            return super().update_shard(store)
+        ascensions = np.asarray(store.columns["ascension_level"], dtype=np.int64)[events["run"]]
+        for key in ('SMITH', 'REST'):
+            chosen = ascensions[events["action"] == ACTION_CODES[key]]
+            self.overall_choices[key] += len(chosen)
+            levels, counts = np.unique(chosen, return_counts=True)
+            for ascension, count in zip(levels.tolist(), counts.tolist()):
+                self.ascension_choices[ascension][key] += count
+
+    def finalize(self):
+        ascension_choices, overall_choices = self.ascension_choices, self.overall_choices
+        # Compute and print overall ratio
+        overall_ratio = overall_choices['SMITH'] / overall_choices['REST'] if overall_choices['REST'] > 0 else 0
+
+        data = [["Overall", overall_choices['SMITH'], overall_choices['REST'], f"{overall_ratio:.2f}"]]
+
+        valid_ascensions = [asc for asc in ascension_choices.keys() if 0 <= int(asc) <= 20]
+        for ascension in sorted(valid_ascensions, key=lambda x: int(x), reverse=True):
+            choices = ascension_choices[ascension]
+            if (choices['SMITH'] + choices['REST']) > 100:  # Only show ascs with a combined total of 100+ picked
+                ratio = choices['SMITH'] / choices['REST'] if choices['REST'] > 0 else 0
+                data.append([ascension, choices['SMITH'], choices['REST'], f"{ratio:.2f}"])
+
+        # Format into the insights structure
+        insights = {
+            "Smith Vs Rest": {
+                "description": "Smith-to-rest ratio at campsites",
+                "headers": ["Ascension Level", "Number of Smiths", "Number of Rests", "Smith-to-Rest Ratio"],
+                "data": data
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def smith_vs_rest_ratio(runs: Iterable[dict]) -> dict:
+    return run_insight(SmithVsRest(), runs)
+
 
+# Runs with the gems pack, from the gems_pack feature decoded at ingest
+def _gem_pack_runs(store) -> Bitmap:
+    return Bitmap.from_mask(np.asarray(store.features["gems_pack"]) != 0)
 
-def gem_impact_on_win_rate(runs: list[dict]) -> dict:
-    total_runs_with_gems = 0
-    wins_with_gems = 0
 
-    total_runs_without_gems = 0
-    wins_without_gems = 0
+@reads("victory", "currentPacks", "basemod:card_modifiers")
+class GemImpact(Insight):
+    columnar = True
+    state_fields = ("total_runs_with_gems", "wins_with_gems", "total_runs_without_gems", "wins_without_gems")
 
-    for run in runs:
-        # Check if the run has the GemsPack
-        if "anniv5:GemsPack" not in run.get('currentPacks', ''):
-            continue
+    def __init__(self):
+        self.total_runs_with_gems = 0
+        self.wins_with_gems = 0
 
-        gem_modifiers = run.get('basemod:card_modifiers', [])
+        self.total_runs_without_gems = 0
+        self.wins_without_gems = 0
+
+    def update(self, run):
+        features = features_of(run)
+        if not features.gems_pack:
+            return
 
         # Check if any card has a gem modifier
-        has_gems = any(gem_modifiers)
+        has_gems = features.has_card_modifiers
 
         if has_gems:
-            total_runs_with_gems += 1
+            self.total_runs_with_gems += 1
             if run.get('victory', False):
-                wins_with_gems += 1
+                self.wins_with_gems += 1
         else:
-            total_runs_without_gems += 1
+            self.total_runs_without_gems += 1
             if run.get('victory', False):
-                wins_without_gems += 1
-
-    # Calculate win rates
-    win_rate_with_gems = make_ratio(wins_with_gems, total_runs_with_gems)
-    win_rate_without_gems = make_ratio(wins_without_gems, total_runs_without_gems)
-
-    insights = {
-        "Gem Impact on Win Rate": {
-            "description": "Win rate of runs with gems pack: gems slotted vs. no gems slotted",
-            "headers": ["Condition", "Wins", "Total", "Win Rate"],
-            "data": [
-                ["With Gems", wins_with_gems, total_runs_with_gems, win_rate_with_gems],
-                ["Without Gems", wins_without_gems, total_runs_without_gems, win_rate_without_gems]
-            ]
+                self.wins_without_gems += 1
+
+    # Only the gems_pack and has_card_modifiers feature columns are read, the victories are a bitmap
+    def update_shard(self, store):
+        if store.features is None:
+            return super().update_shard(store)
+        index = store.index
+        gem_runs = _gem_pack_runs(store)
+        with_gems = gem_runs & Bitmap.from_mask(np.asarray(store.features["has_card_modifiers"]) != 0)
+        without_gems = gem_runs - with_gems
+
+        self.total_runs_with_gems += with_gems.count()
+        self.wins_with_gems += (with_gems & index.victory).count()
+        self.total_runs_without_gems += without_gems.count()
+        self.wins_without_gems += (without_gems & index.victory).count()
+
+    def finalize(self):
+        # Calculate win rates
+        win_rate_with_gems = make_ratio(self.wins_with_gems, self.total_runs_with_gems)
+        win_rate_without_gems = make_ratio(self.wins_without_gems, self.total_runs_without_gems)
+
+        insights = {
+            "Gem Impact on Win Rate": {
+                "description": "Win rate of runs with gems pack: gems slotted vs. no gems slotted",
+                "headers": ["Condition", "Wins", "Total", "Win Rate"],
+                "data": [
+                    ["With Gems", self.wins_with_gems, self.total_runs_with_gems, win_rate_with_gems],
+                    ["Without Gems", self.wins_without_gems, self.total_runs_without_gems, win_rate_without_gems]
+                ]
+            }
         }
-    }
 
-    return insights
+        return insights
+
 
+def gem_impact_on_win_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(GemImpact(), runs)
 
-def gem_count_vs_win_rate(runs: list[dict]) -> dict:
-    gem_count_to_total_runs = defaultdict(int)
-    gem_count_to_wins = defaultdict(int)
 
-    for run in runs:
-        # Check if the run has the GemsPack
-        if "anniv5:GemsPack" not in run.get('currentPacks', ''):
-            continue
+@reads("victory", "currentPacks", "basemod:card_modifiers")
+class GemCountWinRate(Insight):
+    columnar = True
+    state_fields = ("gem_count_to_total_runs", "gem_count_to_wins")
 
-        gem_modifiers = run.get('basemod:card_modifiers', [])
+    def __init__(self):
+        self.gem_count_to_total_runs = defaultdict(int)
+        self.gem_count_to_wins = defaultdict(int)
 
-        gem_count = 0
-        for mod_list in gem_modifiers:
-            if mod_list:
-                for mod in mod_list:
-                    if mod and "thePackmaster.cardmodifiers.gemspack" in mod.get('classname', ''):
-                        gem_count += 1
+    def update(self, run):
+        features = features_of(run)
+        if not features.gems_pack:
+            return
 
-        gem_count_to_total_runs[gem_count] += 1
+        gem_count = features.gem_count
+        self.gem_count_to_total_runs[gem_count] += 1
 
         if run.get('victory', False):
-            gem_count_to_wins[gem_count] += 1
-
-    # Calculate win rates
-    results = []
-    for gem_count, total_runs in gem_count_to_total_runs.items():
-        wins = gem_count_to_wins.get(gem_count, 0)
-        win_rate = make_ratio(wins, total_runs)
-        results.append([gem_count, wins, total_runs, win_rate])
-
-    # Sort results by gem count
-    results.sort(key=lambda x: x[0])
-
-    # Store the results in the desired structure
-    insights = {
-        "Gem Count vs Win Rate": {
-            "description": "Win rate for runs with gems pack by number of gems slotted",
-            "headers": ["Gem Count", "Wins", "Total", "Win Rate"],
-            "data": results
+            self.gem_count_to_wins[gem_count] += 1
+
+    # Gem counts of the runs with the gems pack, counted with bincount
+    def update_shard(self, store):
+        if store.features is None:
+            return super().update_shard(store)
+        index = store.index
+        gem_runs = _gem_pack_runs(store)
+        gem_counts = np.asarray(store.features["gem_count"], dtype=np.int64)
+        totals = np.bincount(gem_counts[gem_runs.mask()])
+        wins = np.bincount(gem_counts[(gem_runs & index.victory).mask()], minlength=len(totals))
+
+        for gem_count in np.flatnonzero(totals).tolist():
+            self.gem_count_to_total_runs[gem_count] += int(totals[gem_count])
+            if wins[gem_count]:
+                self.gem_count_to_wins[gem_count] += int(wins[gem_count])
+
+    def finalize(self):
+        # Calculate win rates
+        results = []
+        for gem_count, total_runs in self.gem_count_to_total_runs.items():
+            wins = self.gem_count_to_wins.get(gem_count, 0)
+            win_rate = make_ratio(wins, total_runs)
+            results.append([gem_count, wins, total_runs, win_rate])
+
+        # Sort results by gem count
+        results.sort(key=lambda x: x[0])
+
+        # Store the results in the desired structure
+        insights = {
+            "Gem Count vs Win Rate": {
+                "description": "Win rate for runs with gems pack by number of gems slotted",
+                "headers": ["Gem Count", "Wins", "Total", "Win Rate"],
+                "data": results
+            }
         }
-    }
-
-    return insights
 
+        return insights
+
+
+def gem_count_vs_win_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(GemCountWinRate(), runs)
+
+
+# Win rate of the runs with the gems pack that slotted a gem type at least once, and how many of it were slotted.
+# Not part of all_insights, add it to the list to get the sheet.
+@reads("victory", "currentPacks", "basemod:card_modifiers")
+class GemTypeWinRate(Insight):
+    columnar = True
+    state_fields = ("runs", "wins", "slotted")
+
+    def __init__(self):
+        self.runs = Counter()
+        self.wins = Counter()
+        self.slotted = Counter()
+
+    def update(self, run):
+        features = features_of(run)
+        if not features.gems_pack:
+            return
+
+        won = run.get('victory', False)
+        self.slotted.update(features.gem_types)
+        for gem_type in dict.fromkeys(features.gem_types):
+            self.runs[gem_type] += 1
+            if won:
+                self.wins[gem_type] += 1
+
+    # The gem types of the runs with the gems pack as (run, gem type) pairs, counted once per run and once per gem
+    def update_shard(self, store):
+        if store.features is None:
+            return super().update_shard(store)
+        offsets = store.features["gem_types.offsets"]
+        gem_ids = np.asarray(store.features["gem_types.values"], dtype=np.int64)
+        rows = np.repeat(np.arange(len(store)), np.diff(offsets))
+        kept = _gem_pack_runs(store).mask()[rows]
+        gem_ids, rows = gem_ids[kept], rows[kept]
+
+        names = store.interners["gems"].values
+        slotted = Counter()
+        _count_ids(slotted, gem_ids)
+        for gem_id, count in slotted.items():
+            self.slotted[names[gem_id]] += count
+
+        pairs = np.unique(rows * len(names) + gem_ids)
+        run_gem_ids = pairs % len(names)
+        won = store.index.victory.mask()[pairs // len(names)]
+        totals = np.bincount(run_gem_ids, minlength=len(names))
+        wins = np.bincount(run_gem_ids[won], minlength=len(names))
+        for gem_id in np.flatnonzero(totals).tolist():
+            self.runs[names[gem_id]] += int(totals[gem_id])
+            if wins[gem_id]:
+                self.wins[names[gem_id]] += int(wins[gem_id])
+
+    def finalize(self):
+        results = []
+        for gem_type, total_runs in self.runs.items():
+            wins = self.wins.get(gem_type, 0)
+            results.append([gem_type, wins, total_runs, make_ratio(wins, total_runs), self.slotted[gem_type]])
+
+        # Most used gems first
+        results.sort(key=lambda x: (-x[2], x[0]))
+
+        return {
+            "Gem Type Win Rate": {
+                "description": "Win rate for runs with gems pack by the gems they slotted",
+                "headers": ["Gem", "Wins", "Runs", "Win Rate", "Slotted"],
+                "data": results
+            }
+        }
 
-def win_rate_by_ascension_and_pack(runs: list[dict]) -> dict:
-    stats = defaultdict(lambda: defaultdict(lambda: {'wins': 0, 'total': 0}))
-    overall_stats = defaultdict(lambda: {'wins': 0, 'total': 0})
 
-    for run in runs:
-        asc_level = run.get('ascension_level', 0)
-        packs = run.get('currentPacks', '').split(',')
-        victory = run.get('victory', False)
+def gem_type_win_rate(runs: Iterable[dict]) -> dict:
+    return run_insight(GemTypeWinRate(), runs)
 
-        for pack in packs:
-            stats[pack][asc_level]['total'] += 1
-            overall_stats[pack]['total'] += 1
-            if victory:
-                stats[pack][asc_level]['wins'] += 1
-                overall_stats[pack]['wins'] += 1
 
-    win_rate_by_pack = defaultdict(dict)
+@reads("victory", "ascension_level", "currentPacks")
+class WinRateByAscAndPack(CubeInsight):
+    def finalize(self):
+        self.cube.flush()
+        pack_wins = self.cube.pack_wins.tolist()
+        pack_totals = self.cube.pack_totals.tolist()
 
-    for pack, asc_data in stats.items():
-        if pack:
-            win_rate_by_pack[pack]['Overall'] = make_ratio(overall_stats[pack]['wins'], overall_stats[pack]['total'])
-            for asc_level, data in asc_data.items():
-                win_rate = make_ratio(data['wins'], data['total'])
-                win_rate_by_pack[pack][asc_level] = win_rate
+        all_asc_levels = [level for level in range(MAX_ASCENSION, -1, -1)]
 
-    all_asc_levels = [level for level in range(20, -1, -1)]
-
-    insight = {
-        "Win Rate by Pack and Asc": {
-            "description": "Pack win rates across ascension levels",
-            "headers": ["Pack","Overall Win Rate"] + [f"A{level}" for level in all_asc_levels],
-            "data": []
+        insight = {
+            "Win Rate by Pack and Asc": {
+                "description": "Pack win rates across ascension levels",
+                "headers": ["Pack","Overall Win Rate"] + [f"A{level}" for level in all_asc_levels],
+                "data": []
+            }
         }
-    }
 
-    for pack, asc_data in win_rate_by_pack.items():
-        row = [del_prefix(pack), asc_data.get('Overall', "N/A")]
-        for asc_level in all_asc_levels:
-            row.append(asc_data.get(asc_level, "N/A"))  # Use "N/A" if no data for this ascension level
-        insight["Win Rate by Pack and Asc"]["data"].append(row)
+        for index, pack in enumerate(self.cube.packs):
+            if pack:
+                wins, totals = pack_wins[index], pack_totals[index]
+                row = [del_prefix(pack), make_ratio(sum(wins), sum(totals))]
+                for asc_level in all_asc_levels:
+                    # Use "N/A" if no data for this ascension level
+                    row.append(make_ratio(wins[asc_level], totals[asc_level]) if totals[asc_level] else "N/A")
+                insight["Win Rate by Pack and Asc"]["data"].append(row)
 
-    return insight
+        return insight
 
 
-def win_rate_deviation_between_asc(runs: list[dict]) -> dict:
-    pack_stats = defaultdict(lambda: defaultdict(lambda: {'wins': 0, 'total': 0}))
-    asc_level_stats = defaultdict(lambda: {'wins': 0, 'total': 0})
+def win_rate_by_ascension_and_pack(runs: Iterable[dict]) -> dict:
+    return run_insight(WinRateByAscAndPack(), runs)
 
-    for run in runs:
-        asc_level = run.get('ascension_level', 0)
-        packs = run.get('currentPacks', '').split(',')
-        victory = run.get('victory', False)
 
-        asc_level_stats[asc_level]['total'] += 1
-        if victory:
-            asc_level_stats[asc_level]['wins'] += 1
+@reads("victory", "ascension_level", "currentPacks")
+class WinRateDeviationBetweenAsc(CubeInsight):
+    def finalize(self):
+        self.cube.flush()
+        pack_wins = self.cube.pack_wins.tolist()
+        pack_totals = self.cube.pack_totals.tolist()
 
-        for pack in packs:
-            pack_stats[pack][asc_level]['total'] += 1
-            if victory:
-                pack_stats[pack][asc_level]['wins'] += 1
-
-    insights_data = []
-    for pack, asc_data in pack_stats.items():
-        if pack:
-            asc_0_data = asc_data.get(0, {'wins': 0, 'total': 0})
-            asc_20_data = asc_data.get(20, {'wins': 0, 'total': 0})
-            asc_0_winrate = asc_0_data['wins'] / asc_0_data['total'] if asc_0_data['total'] > 0 else 0
-            asc_20_winrate = asc_20_data['wins'] / asc_20_data['total'] if asc_20_data['total'] > 0 else 0
-
-            deviation = asc_0_winrate - asc_20_winrate
-
-            insights_data.append([
-                del_prefix(pack),
-                f"{asc_0_winrate * 100:.2f}",
-                f"{asc_20_winrate * 100:.2f}",
-                f"{deviation:.2%}"
-            ])
-
-    insights_data.sort(key=lambda x: float(x[3][:-1]), reverse=True)
-
-    insights = {
-        "Pack Win Rate Difference Between A0 and A20": {
-            "description": "Difference in pack win rate between ascension 0 and ascension 20",
-            "headers": ["Pack", "Asc 0 Win Rate", "Asc 20 Win Rate", "Difference"],
-            "data": insights_data
+        insights_data = []
+        for index, pack in enumerate(self.cube.packs):
+            if pack:
+                wins, totals = pack_wins[index], pack_totals[index]
+                asc_0_winrate = wins[0] / totals[0] if totals[0] > 0 else 0
+                asc_20_winrate = wins[MAX_ASCENSION] / totals[MAX_ASCENSION] if totals[MAX_ASCENSION] > 0 else 0
+
+                deviation = asc_0_winrate - asc_20_winrate
+
+                insights_data.append([
+                    del_prefix(pack),
+                    f"{asc_0_winrate * 100:.2f}",
+                    f"{asc_20_winrate * 100:.2f}",
+                    f"{deviation:.2%}"
+                ])
+
+        insights_data.sort(key=lambda x: float(x[3][:-1]), reverse=True)
+
+        insights = {
+            "Pack Win Rate Difference Between A0 and A20": {
+                "description": "Difference in pack win rate between ascension 0 and ascension 20",
+                "headers": ["Pack", "Asc 0 Win Rate", "Asc 20 Win Rate", "Difference"],
+                "data": insights_data
+            }
         }
-    }
 
-    return insights
+        return insights
 
 
-def win_rate_deviation_from_average_by_asc(runs: list[dict]) -> dict:
-    pack_stats = defaultdict(lambda: defaultdict(lambda: {'wins': 0, 'total': 0}))
-    asc_level_stats = defaultdict(lambda: {'wins': 0, 'total': 0})
+def win_rate_deviation_between_asc(runs: Iterable[dict]) -> dict:
+    return run_insight(WinRateDeviationBetweenAsc(), runs)
 
-    for run in runs:
-        asc_level = run.get('ascension_level', 0)
-        packs = run.get('currentPacks', '').split(',')
-        victory = run.get('victory', False)
 
-        asc_level_stats[asc_level]['total'] += 1
-        if victory:
-            asc_level_stats[asc_level]['wins'] += 1
+@reads("victory", "ascension_level", "currentPacks")
+class WinRateDeviationFromAverage(CubeInsight):
+    def finalize(self):
+        cube = self.cube
+        cube.flush()
+        pack_wins = cube.pack_wins.tolist()
+        pack_totals = cube.pack_totals.tolist()
 
-        for pack in packs:
-            pack_stats[pack][asc_level]['total'] += 1
-            if victory:
-                pack_stats[pack][asc_level]['wins'] += 1
-
-    # Calculate overall average win rates by ascension level
-    average_win_rates_by_asc = {}
-    for asc_level, data in asc_level_stats.items():
-        average_win_rates_by_asc[asc_level] = data['wins'] / data['total'] if data['total'] > 0 else 0
-
-    insights_data = []
-    for pack, asc_data in pack_stats.items():
-        if pack:
-            # Calculate win rates for specific ascension levels for the pack
-            asc_0_data = asc_data.get(0, {'wins': 0, 'total': 0})
-            asc_20_data = asc_data.get(20, {'wins': 0, 'total': 0})
-            pack_asc_0_winrate = asc_0_data['wins'] / asc_0_data['total'] if asc_0_data['total'] > 0 else 0
-            pack_asc_20_winrate = asc_20_data['wins'] / asc_20_data['total'] if asc_20_data['total'] > 0 else 0
-
-            # Calculate deviations from the overall average win rates
-            deviation_0 = pack_asc_0_winrate - average_win_rates_by_asc.get(0, 0)
-            deviation_20 = pack_asc_20_winrate - average_win_rates_by_asc.get(20, 0)
-
-            insights_data.append([
-                del_prefix(pack),
-                f"{pack_asc_0_winrate * 100:.2f}",
-                f"{pack_asc_20_winrate * 100:.2f}",
-                f"{deviation_0:.2%}",
-                f"{deviation_20:.2%}"
-            ])
-
-    insights = {
-        "Win Rate Difference from Average": {
-            "description": "Win rates for each pack against the average win rate (across all packs) for ascension levels 0 and 20",
-            "headers": ["Pack", "Pack Asc 0 Win Rate", "Pack Asc 20 Win Rate", "Difference from Avg Asc 0", "Difference from Avg Asc 20"],
-            "data": insights_data
+        # Calculate overall average win rates by ascension level
+        asc_wins, asc_totals = cube.asc_wins.tolist(), cube.asc_totals.tolist()
+        average_asc_0 = asc_wins[0] / asc_totals[0] if asc_totals[0] > 0 else 0
+        average_asc_20 = asc_wins[MAX_ASCENSION] / asc_totals[MAX_ASCENSION] if asc_totals[MAX_ASCENSION] > 0 else 0
+
+        insights_data = []
+        for index, pack in enumerate(cube.packs):
+            if pack:
+                # Calculate win rates for specific ascension levels for the pack
+                wins, totals = pack_wins[index], pack_totals[index]
+                pack_asc_0_winrate = wins[0] / totals[0] if totals[0] > 0 else 0
+                pack_asc_20_winrate = wins[MAX_ASCENSION] / totals[MAX_ASCENSION] if totals[MAX_ASCENSION] > 0 else 0
+
+                # Calculate deviations from the overall average win rates
+                deviation_0 = pack_asc_0_winrate - average_asc_0
+                deviation_20 = pack_asc_20_winrate - average_asc_20
+
+                insights_data.append([
+                    del_prefix(pack),
+                    f"{pack_asc_0_winrate * 100:.2f}",
+                    f"{pack_asc_20_winrate * 100:.2f}",
+                    f"{deviation_0:.2%}",
+                    f"{deviation_20:.2%}"
+                ])
+
+        insights = {
+            "Win Rate Difference from Average": {
+                "description": "Win rates for each pack against the average win rate (across all packs) for ascension levels 0 and 20",
+                "headers": ["Pack", "Pack Asc 0 Win Rate", "Pack Asc 20 Win Rate", "Difference from Avg Asc 0", "Difference from Avg Asc 20"],
+                "data": insights_data
+            }
         }
-    }
 
-    return insights
+        return insights
+
+
+def win_rate_deviation_from_average_by_asc(runs: Iterable[dict]) -> dict:
+    return run_insight(WinRateDeviationFromAverage(), runs)
 
 
 # Pick rate deviation of pack average by card (excluding special cards)
-def card_pick_deviation(runs: list[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
-    picked_counts = Counter()
-    not_picked_counts = Counter()
-    card_pick_rates = {}  # To store pick rates of each card
-    pack_pick_rates = defaultdict(list)  # To store pick rates of cards for calculating pack averages
-
-    # Count picks and not picks
-    for data_dict in runs:
-        current_packs = set(data_dict.get("currentPacks", "").split(","))
+@reads("currentPacks", "card_choices")
+class CardPickDeviation(CatalogInsight):
+    columnar = True
+    state_fields = ("picked_counts", "not_picked_counts")
+
+    def __init__(self, catalog: CardCatalog):
+        super().__init__(catalog)
+        self.special = catalog.rarity_ids.get("Special")
+        self.picked_counts = Counter()
+        self.not_picked_counts = Counter()
+
+    # Count picks and not picks (by card id, upgraded card choices aren't scored differently)
+    def update(self, data_dict):
+        catalog = self.catalog
+        lookup = catalog.lookup
+        special = self.special
+        current_packs = {catalog.pack_ids.get(pack) for pack in features_of(data_dict).packs}
         card_choices = data_dict.get("card_choices", [])
         for choice in card_choices:
-            picked = del_upg(choice.get("picked"))  # Do not score upgraded card choices differently
-            not_picked = [del_upg(card) for card in choice.get("not_picked", [])]
-
-            # Exclude special rarity cards from both picked and not picked
-            if picked and card_to_pack.get(picked) in current_packs and card_to_rarity.get(picked) != "Special":
-                picked_counts.update([picked])
-
-            not_picked = [card for card in not_picked if card_to_pack.get(card) in current_packs and card_to_rarity.get(card) != "Special"]
-            not_picked_counts.update(not_picked)
-
-    # Calculate pick rates for each card and aggregate them into packs
-    for choice, picked_count in picked_counts.items():
-        not_picked_count = not_picked_counts[choice]
-        total_count = picked_count + not_picked_count
-        pick_rate = picked_count / total_count if total_count > 0 else 0
-        card_pick_rates[choice] = pick_rate
-        pack_pick_rates[card_to_pack[choice]].append(pick_rate)
-
-    # Calculate the average pick rate for each pack
-    pack_average_pick_rates = {pack: statistics.mean(rates) for pack, rates in pack_pick_rates.items() if rates}
-
-    # Calculate deviation of each card's pick rate from its pack's average
-    card_deviations = {}
-    for card, pick_rate in card_pick_rates.items():
-        pack = card_to_pack[card]
-        pack_average = pack_average_pick_rates[pack]
-        deviation = pick_rate - pack_average
-        card_deviations[card] = deviation
-
-    insights = {
-        "Card Pick Rate vs Pack Average": {
-            "description": "Difference in card pick rate from the pack's average",
-            "headers": ["Pack", "Card", "Pick Rate", "Pack Average", "Difference"],
-            "data": [
-                [del_prefix(card_to_pack[card]), del_prefix(card), f"{card_pick_rates[card] * 100:.2f}",
-                 f"{pack_average_pick_rates[card_to_pack[card]] * 100:.2f}", f"{deviation:.2%}"]
-                for card, deviation in sorted(card_deviations.items(), key=lambda x: x[1], reverse=True)
-            ]
+            # Exclude special rarity cards and cards of packs that aren't in the run from both picked and not picked
+            picked = lookup(choice.get("picked"))
+            if picked.pack_id >= 0 and picked.pack_id in current_packs and picked.rarity_id != special:
+                self.picked_counts[picked.card_id] += 1
+
+            for card in choice.get("not_picked", []):
+                not_picked = lookup(card)
+                if not_picked.pack_id >= 0 and not_picked.pack_id in current_packs and not_picked.rarity_id != special:
+                    self.not_picked_counts[not_picked.card_id] += 1
+
+    def update_shard(self, store):
+        events = self.choice_events(store)
+        if events is None:
+            return super().update_shard(store)
+        counted = events["in_run_packs"]
+        if self.special is not None:
+            counted = counted & (np.array(self.catalog.card_rarity, dtype=np.int64)[events["card"]] != self.special)
+        picked = events["picked"]
+        _count_ids(self.picked_counts, events["card"][counted & picked])
+        _count_ids(self.not_picked_counts, events["card"][counted & ~picked])
+
+    def finalize(self):
+        catalog = self.catalog
+        card_pick_rates = {}  # To store pick rates of each card
+        pack_pick_rates = defaultdict(list)  # To store pick rates of cards for calculating pack averages
+
+        # Calculate pick rates for each card and aggregate them into packs
+        for card_id, picked_count in self.picked_counts.items():
+            not_picked_count = self.not_picked_counts[card_id]
+            total_count = picked_count + not_picked_count
+            pick_rate = picked_count / total_count if total_count > 0 else 0
+            card_pick_rates[card_id] = pick_rate
+            pack_pick_rates[catalog.pack_of(card_id)].append(pick_rate)
+
+        # Calculate the average pick rate for each pack
+        pack_average_pick_rates = {pack: statistics.mean(rates) for pack, rates in pack_pick_rates.items() if rates}
+
+        # Calculate deviation of each card's pick rate from its pack's average
+        card_deviations = {}
+        for card_id, pick_rate in card_pick_rates.items():
+            pack = catalog.pack_of(card_id)
+            pack_average = pack_average_pick_rates[pack]
+            deviation = pick_rate - pack_average
+            card_deviations[card_id] = deviation
+
+        insights = {
+            "Card Pick Rate vs Pack Average": {
+                "description": "Difference in card pick rate from the pack's average",
+                "headers": ["Pack", "Card", "Pick Rate", "Pack Average", "Difference"],
+                "data": [
+                    [del_prefix(catalog.pack_of(card_id)), del_prefix(catalog.cards[card_id]),
+                     f"{card_pick_rates[card_id] * 100:.2f}",
+                     f"{pack_average_pick_rates[catalog.pack_of(card_id)] * 100:.2f}", f"{deviation:.2%}"]
+                    for card_id, deviation in sorted(card_deviations.items(), key=lambda x: x[1], reverse=True)
+                ]
+            }
         }
-    }
-    return insights
+        return insights
+
+
+def card_pick_deviation(runs: Iterable[dict], card_to_pack: dict, card_to_rarity: dict) -> dict:
+    return run_insight(CardPickDeviation(CardCatalog(card_to_pack, card_to_rarity)), runs)
+
+
+# Every insight main.py uploads, in sheet order. The card insights share one catalog and the win rate sheets by
+# pack and ascension one cube, the host sheets one host table (or host sketch with sketch_hosts).
+def all_insights(card_to_pack: dict, card_to_rarity: dict, sketch_hosts: bool = False) -> list:
+    catalog = CardCatalog(card_to_pack, card_to_rarity)
+    cube = PackAscensionCube()
+    hosts = HostSketch() if sketch_hosts else HostTable()
+    return [
+        WinRatesPerAsc(cube),
+        WinRateByAscAndPack(cube),
+        PackPickRate(),
+        PackWinRate(),
+        CardPickRate(catalog),
+        CardWinRate(catalog),
+        WinRateDeviationBetweenAsc(cube),
+        WinRateDeviationFromAverage(cube),
+        CardPickDeviation(catalog),
+        HatPickRate(),
+        HatWinRate(),
+        MedianDeckSizes(),
+        TurnLengthPerEnemy(),
+        HealthBeforeRest(),
+        HPCurvePercentiles(),
+        SmithVsRest(),
+        GemImpact(),
+        GemCountWinRate(),
+        UpgradedCardWinRate(catalog),
+        FilteredPacks(hosts),
+        RunsByHost(hosts),
+        ExpansionPackUsage(),
+    ]
@@ -62,3 +62,14 @@ def write_insight_to_file(insights, output_directory="insight_files"):
             for row in data:
                 file.write(format_row(row, col_widths) + "\n")
             file.write("-" * len(header_row) + "\n")  # End separator
+
+
+# Flattens the {segment: results} of engine.run_segmented_insights into one list of results, every sheet is named after
+# its segment so each segment gets its own sheet (or file with write_insight_to_file)
+def segment_sheets(segmented_results: dict) -> list[dict]:
+    sheets = []
+    for segment, results in segmented_results.items():
+        for insights in results:
+            sheets.append({f"{sheet_name} ({segment})": {**details, "description": f"{details['description']} ({segment})"}
+                           for sheet_name, details in insights.items()})
+    return sheets
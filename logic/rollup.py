@@ -0,0 +1,202 @@
+import time
+
+import numpy as np
+
+from logic.engine import Accumulator
+from logic.features import features_of
+from logic.insights import MAX_ASCENSION
+from logic.storage import Interner, keys_in_range
+from logic.transformations import CardCatalog, del_prefix, make_ratio, split_upgrade
+
+# Counts kept for every (day, name, ascension level) row
+WINS, TOTALS, PICKS, OFFERS = range(4)
+STATS = ("wins", "totals", "picks", "offers")
+
+# Ascension levels outside of 0 to MAX_ASCENSION are counted in one extra bucket, like in the pack × ascension cube
+OTHER_ASCENSION = MAX_ASCENSION + 1
+
+
+def _level(run) -> int:
+    level = run.get('ascension_level', 0)
+    return level if type(level) is int and 0 <= level <= MAX_ASCENSION else OTHER_ASCENSION
+
+
+# Rollup of a single day: wins and totals of the runs a pack or card (without upgrade) was in and how often it was
+# picked and offered, per ascension level. Its state is saved as a partial of the day's partition.
+class DayRollup(Accumulator):
+    version = 2
+
+    def __init__(self):
+        self.packs = {}
+        self.cards = {}
+
+    @staticmethod
+    def _row(counts, name, level):
+        row = counts.get((name, level))
+        if row is None:
+            row = counts[(name, level)] = [0, 0, 0, 0]
+        return row
+
+    def update(self, run):
+        level = _level(run)
+        won = bool(run.get('victory', False))
+        features = features_of(run)
+
+        for pack in features.packs:
+            row = self._row(self.packs, pack, level)
+            row[WINS] += won
+            row[TOTALS] += 1
+        for choice in run.get("packChoices", []):
+            picked = choice.get("picked", "")
+            row = self._row(self.packs, picked, level)
+            row[PICKS] += 1
+            row[OFFERS] += 1
+            for pack in choice.get("not_picked", []):
+                self._row(self.packs, pack, level)[OFFERS] += 1
+
+        for card in features.deck:
+            row = self._row(self.cards, card, level)
+            row[WINS] += won
+            row[TOTALS] += 1
+        for choice in run.get("card_choices", []):
+            picked = choice.get("picked")
+            if picked:
+                row = self._row(self.cards, split_upgrade(picked)[0], level)
+                row[PICKS] += 1
+                row[OFFERS] += 1
+            for card in choice.get("not_picked", []):
+                self._row(self.cards, split_upgrade(card)[0], level)[OFFERS] += 1
+
+    def state(self):
+        return {"packs": self.packs, "cards": self.cards}
+
+    def merge(self, state):
+        for table in ("packs", "cards"):
+            counts = getattr(self, table)
+            for key, values in state[table].items():
+                row = self._row(counts, *key)
+                for stat, value in enumerate(values):
+                    row[stat] += value
+
+
+# Sparse rows of (day, name, level) with their counts, range queries mask the rows and add them up by name
+class RollupTable:
+    def __init__(self):
+        self.names = Interner()
+        self._days, self._names, self._levels, self._counts = [], [], [], []
+        self.days = np.zeros(0, dtype=np.int32)
+        self.name_ids = np.zeros(0, dtype=np.int32)
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.counts = np.zeros((0, len(STATS)), dtype=np.int64)
+
+    def add_day(self, day: int, counts: dict):
+        for (name, level), values in counts.items():
+            self._days.append(day)
+            self._names.append(self.names.intern(name))
+            self._levels.append(level)
+            self._counts.append(values)
+
+    def build(self):
+        self.days = np.array(self._days, dtype=np.int32)
+        self.name_ids = np.array(self._names, dtype=np.int32)
+        self.levels = np.array(self._levels, dtype=np.int8)
+        self.counts = np.array(self._counts, dtype=np.int64).reshape(-1, len(STATS))
+
+    # {name: [wins, totals, picks, offers]} summed over the given days (and ascension levels, all if None)
+    def sum(self, days, levels=None) -> dict:
+        mask = np.isin(self.days, days)
+        if levels is not None:
+            mask &= np.isin(self.levels, list(levels))
+        sums = np.zeros((len(self.names), len(STATS)), dtype=np.int64)
+        np.add.at(sums, self.name_ids[mask], self.counts[mask])
+        names = self.names.values
+        return {names[name_id]: sums[name_id].tolist() for name_id in np.flatnonzero(sums.any(axis=1)).tolist()}
+
+
+# Daily rollup of the pack and card counts of the whole cache. Every day is computed once and saved with the day's
+# partition (like the partial insight states), so building the rollup after new days came in only reads those days.
+# Questions about a date range are then answered by adding up the rows of its days, no run is read.
+class DailyRollup:
+    def __init__(self, days):
+        self.days = list(days)
+        self.day_index = {day: index for index, day in enumerate(self.days)}
+        self.packs = RollupTable()
+        self.cards = RollupTable()
+
+    @classmethod
+    def build(cls, cache):
+        start_time = time.perf_counter()
+        rollup = cls(cache.keys())
+        name = DayRollup().partial_name
+        computed = 0
+
+        for index, key in enumerate(rollup.days):
+            state = cache.load_partial(key, name)
+            if state is None:
+                day = DayRollup()
+                for run in cache.partition(key):
+                    day.update(run)
+                state = day.state()
+                cache.save_partial(key, name, state)
+                computed += 1
+            rollup.packs.add_day(index, state["packs"])
+            rollup.cards.add_day(index, state["cards"])
+
+        rollup.packs.build()
+        rollup.cards.build()
+        print(f"Built the daily rollup of {len(rollup.days)} days ({computed} read, the rest from saved partials) "
+              f"in {time.perf_counter() - start_time:.2f}s")
+        return rollup
+
+    # Indices of the days between start and end (inclusive), see storage.keys_in_range
+    def _days(self, start=None, end=None):
+        return [self.day_index[day] for day in keys_in_range(self.days, start, end)]
+
+    def pack_counts(self, start=None, end=None, levels=None) -> dict:
+        return self.packs.sum(self._days(start, end), levels)
+
+    def card_counts(self, start=None, end=None, levels=None) -> dict:
+        return self.cards.sum(self._days(start, end), levels)
+
+
+# Same sheet as PackWinRate, limited to the days between start and end
+def rollup_pack_win_rate(rollup: DailyRollup, start=None, end=None) -> dict:
+    counts = rollup.pack_counts(start, end)
+    # Sorted like PackWinRate, by win rate and then by pack
+    packs = sorted((pack for pack, values in counts.items() if values[TOTALS] > 0),
+                   key=lambda pack: (-counts[pack][WINS] / counts[pack][TOTALS], pack))
+    rows = [[del_prefix(pack), counts[pack][WINS], counts[pack][TOTALS],
+             make_ratio(counts[pack][WINS], counts[pack][TOTALS])] for pack in packs]
+
+    return {
+        "Pack Win Rate": {
+            "description": f"Win rate for each pack between {start or 'the start'} and {end or 'the end'}",
+            "headers": ["Pack", "Wins", "Total", "Win Rate"],
+            "data": rows
+        }
+    }
+
+
+# Same rows as the CardPickRate sheet (picked cards in a pack, without Special ones), limited to the days between start
+# and end. The sheet has its own name so it never replaces the main one.
+def rollup_card_pick_rate(rollup: DailyRollup, card_to_pack: dict, card_to_rarity: dict, start=None, end=None) -> dict:
+    catalog = CardCatalog(card_to_pack, card_to_rarity)
+    counts = rollup.card_counts(start, end)
+    rows = []
+    for card, values in counts.items():
+        card_id = catalog.card_id(card)
+        rarity = catalog.rarity_of(card_id)
+        if values[PICKS] > 0 and rarity != "Special" and catalog.card_pack[card_id] >= 0:
+            rows.append([rarity, del_prefix(catalog.pack_of(card_id)), del_prefix(card), values[PICKS], values[OFFERS],
+                         make_ratio(values[PICKS], values[OFFERS])])
+    # Sorted like CardPickRate, by pick rate and then by pack and card
+    rows.sort(key=lambda row: (-float(row[5]), row[1], row[2]))
+
+    return {
+        "Card Pick Rate (Rollup)": {
+            "description": f"How often a card is picked when offered as a card reward between {start or 'the start'} "
+                           f"and {end or 'the end'}",
+            "headers": ["Rarity", "Pack", "Card", "Picked", "Seen", "Pick Rate"],
+            "data": rows
+        }
+    }
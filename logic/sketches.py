@@ -0,0 +1,236 @@
+import hashlib
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+
+
+# Value at a 0 based rank of a {value: count} histogram, sorted_items are its items sorted by value
+def _value_at(sorted_items, rank):
+    for value, count in sorted_items:
+        if rank < count:
+            return value
+        rank -= count
+    raise IndexError("Rank is outside of the histogram")
+
+
+# Same result as statistics.median over the values the histogram counts
+def histogram_median(histogram: dict):
+    items = sorted(histogram.items())
+    total = sum(count for _, count in items)
+    if total == 0:
+        raise ValueError("No median for an empty histogram")
+    if total % 2 == 1:
+        return _value_at(items, total // 2)
+    return (_value_at(items, total // 2 - 1) + _value_at(items, total // 2)) / 2
+
+
+# Quantile q (0 to 1) of the values the histogram counts, interpolated linearly between the closest ranks
+def histogram_quantile(histogram: dict, q: float):
+    items = sorted(histogram.items())
+    total = sum(count for _, count in items)
+    if total == 0:
+        raise ValueError("No quantile for an empty histogram")
+
+    position = q * (total - 1)
+    rank = int(position)
+    fraction = position - rank
+    lower = _value_at(items, rank)
+    if fraction == 0:
+        return lower
+    upper = _value_at(items, rank + 1)
+    if upper == lower:
+        return lower
+    return lower + (upper - lower) * fraction
+
+
+# Mergeable quantile sketch for floats. Values are kept exactly until there are more than exact_limit distinct ones,
+# then they're compacted into bins of a fixed width (only bins that are hit are stored) and quantiles are read from the
+# bin centers, so they're off by at most half a bin width. Small inputs give the same quantiles as the plain values.
+class QuantileSketch:
+    def __init__(self, width: float = 1e-5, exact_limit: int = 10000):
+        self.width = width
+        self.exact_limit = exact_limit
+        self.values = Counter()  # None once the sketch is compacted
+        self.bins = Counter()
+
+    def _compact(self):
+        for value, count in self.values.items():
+            self.bins[round(value / self.width)] += count
+        self.values = None
+
+    def add(self, value: float):
+        if self.values is None:
+            self.bins[round(value / self.width)] += 1
+            return
+        self.values[value] += 1
+        if len(self.values) > self.exact_limit:
+            self._compact()
+
+    # Adds a numpy array of values, binned like add bins them one by one
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.values is None:
+            indices, counts = np.unique(np.rint(values / self.width), return_counts=True)
+            for index, count in zip(indices.tolist(), counts.tolist()):
+                self.bins[int(index)] += count
+            return
+        distinct, counts = np.unique(values, return_counts=True)
+        for value, count in zip(distinct.tolist(), counts.tolist()):
+            self.values[value] += count
+        if len(self.values) > self.exact_limit:
+            self._compact()
+
+    def __len__(self):
+        return sum((self.values if self.values is not None else self.bins).values())
+
+    def __iadd__(self, other):
+        if other.width != self.width:
+            raise ValueError("Can't merge sketches with different bin widths.")
+        if other.values is None:
+            if self.values is not None:
+                self._compact()
+            self.bins.update(other.bins)
+        elif self.values is None:
+            for value, count in other.values.items():
+                self.bins[round(value / self.width)] += count
+        else:
+            self.values.update(other.values)
+            if len(self.values) > self.exact_limit:
+                self._compact()
+        return self
+
+    def __add__(self, other):
+        merged = QuantileSketch(self.width, self.exact_limit)
+        merged += self
+        merged += other
+        return merged
+
+    def _histogram(self) -> dict:
+        if self.values is not None:
+            return self.values
+        return {index * self.width: count for index, count in self.bins.items()}
+
+    def median(self) -> float:
+        return histogram_median(self._histogram())
+
+    def quantile(self, q: float) -> float:
+        return histogram_quantile(self._histogram(), q)
+
+
+# 64 bit hash of a string that is the same in every process (hash() of a str is salted per interpreter)
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+# HyperLogLog estimate of the number of distinct strings added, in a fixed 2^precision bytes no matter how many strings
+# there are. The relative standard error is about 1.04 / sqrt(2^precision): 1.6% with the default precision of 12
+# (4 KiB), about 95% of the estimates are within twice that. Small counts use linear counting and are close to exact.
+# Adding a string again doesn't change the sketch, merging takes the larger register and is lossless.
+class HyperLogLog:
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("The precision of a HyperLogLog has to be between 4 and 16.")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, value: str):
+        hashed = _hash64(value)
+        register = hashed >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        # Position of the first set bit in the bits left after the register index
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def __iadd__(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLogs with different precisions.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def __add__(self, other):
+        merged = HyperLogLog(self.precision)
+        merged += self
+        merged += other
+        return merged
+
+    def count(self) -> int:
+        size = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and empty:
+            estimate = size * math.log(size / empty)
+        return int(round(estimate))
+
+
+# Space-Saving top-k of the most frequent strings, in at most capacity counters no matter how many strings there are.
+# A count is never below the true count and at most error(value) above it, which is at most total / capacity. Every
+# string that occurs more than total / capacity times is kept. Merged sketches keep those bounds with the summed totals.
+class SpaceSaving:
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # Min heap of (count, value), entries go stale when a count grows and are refreshed when they come up
+        self._heap = []
+
+    def add(self, value: str, count: int = 1):
+        self.total += count
+        if value in self.counts:
+            self.counts[value] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = count
+            self.errors[value] = 0
+            heapq.heappush(self._heap, (count, value))
+        else:
+            # The new value takes over the smallest counter, its count may include all of the evicted count
+            smallest, evicted = self._pop_smallest()
+            del self.counts[evicted], self.errors[evicted]
+            self.counts[value] = smallest + count
+            self.errors[value] = smallest
+            heapq.heappush(self._heap, (smallest + count, value))
+
+    def _pop_smallest(self):
+        while True:
+            count, value = heapq.heappop(self._heap)
+            if self.counts[value] == count:
+                return count, value
+            heapq.heappush(self._heap, (self.counts[value], value))
+
+    # Counts of values the other sketch didn't keep are only known to be at most its smallest count
+    def _floor(self) -> int:
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def __iadd__(self, other):
+        if other.capacity != self.capacity:
+            raise ValueError("Can't merge Space-Saving sketches with different capacities.")
+        own_floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for value in [*self.counts, *(value for value in other.counts if value not in self.counts)]:
+            counts[value] = self.counts.get(value, own_floor) + other.counts.get(value, other_floor)
+            errors[value] = self.errors.get(value, own_floor) + other.errors.get(value, other_floor)
+
+        kept = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+        self.counts = {value: counts[value] for value in kept}
+        self.errors = {value: errors[value] for value in kept}
+        self.total += other.total
+        self._heap = [(count, value) for value, count in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def __add__(self, other):
+        merged = SpaceSaving(self.capacity)
+        merged += self
+        merged += other
+        return merged
+
+    def error(self, value: str) -> int:
+        return self.errors.get(value, self._floor())
+
+    # [(value, count)] of the kept values, the most frequent first (ties in the order the values were kept)
+    def most_common(self) -> list:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
@@ -1,42 +1,291 @@
+import bz2
+import datetime
+import gzip
+import hashlib
 import json
+import lzma
 import os
 import pickle
-from collections import defaultdict
+import shutil
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
 
+import numpy as np
 
-def process_file(directory, file_path, encoding='utf-8'):
-    data = {}
-    # Create a sub list based on the path of the file from the working directory
-    relative_path = os.path.relpath(file_path, start=directory).replace('\\', '/')
+from logic.bitmaps import RunIndex
+from logic.events import EVENT_TABLES, derive_events
+from logic.features import FEATURES_KEY, FEATURES_VERSION, RunFeatures, derive_features
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Files larger than this get split into newline aligned byte ranges which can be parsed by separate workers
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _relative_key(directory, file_path):
+    return os.path.relpath(file_path, start=directory).replace('\\', '/')
+
+
+# Splits a file into (start, end) byte ranges, every range ends right after a newline
+def split_file(file_path, chunk_size=CHUNK_SIZE):
+    size = os.path.getsize(file_path)
+    ranges = []
+    start = 0
+
+    with open(file_path, 'rb') as file:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # Move the boundary to the end of the line it landed in
+                file.seek(end - 1)
+                file.readline()
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+# Run fields the loader always keeps next to the projected ones
+BASE_FIELDS = frozenset({"host", "time"})
+
+# Compressed single file shards, these are streamed through the decompressor instead of being split into byte ranges
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def _loads(line, encoding):
+    # orjson parses straight from the raw bytes, lines it rejects (bad utf-8, NaN...) fall back to the json module
+    if orjson is not None and encoding == 'utf-8':
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(line.decode(encoding, errors='replace'))
+
+
+# Parses the given lines, returns the runs, the indices of bad lines and the line count.
+# If fields is given, only those keys of every run are kept.
+def _parse_lines(lines, encoding='utf-8', fields=None):
+    runs = []
+    bad_lines = []
+    line_count = 0
+
+    for line in lines:
+        try:
+            # Parse each line as JSON and convert it into a dictionary
+            run = _loads(line, encoding)
+            event = run['event']
+            if fields is not None:
+                event = {key: event[key] for key in fields if key in event}
+            event['host'] = run.get('host', '')
+            event['time'] = run.get('time', '')
+            runs.append(event)
+        except json.JSONDecodeError:
+            bad_lines.append(line_count)
+        line_count += 1
+
+    return runs, bad_lines, line_count
+
+
+def _lines_in_range(file, start, end):
+    position = start
+    file.seek(start)
+    for line in file:
+        if position >= end:
+            break
+        position += len(line)
+        yield line
+
+
+# Parses one task: a byte range of a plain file, a whole compressed file or a member of a zip archive
+def _parse_task(file_path, member, start, end, encoding='utf-8', fields=None):
+    if member is not None:
+        with zipfile.ZipFile(file_path) as archive, archive.open(member) as file:
+            # Compressed members are decompressed like compressed files
+            opener = COMPRESSED_OPENERS.get(os.path.splitext(member)[1].lower())
+            if opener is not None:
+                with opener(file, 'rb') as decompressed:
+                    return _parse_lines(decompressed, encoding, fields)
+            return _parse_lines(file, encoding, fields)
+
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(file_path)[1].lower())
+    if opener is not None:
+        with opener(file_path, 'rb') as file:
+            return _parse_lines(file, encoding, fields)
+
+    with open(file_path, 'rb') as file:
+        return _parse_lines(_lines_in_range(file, start, end), encoding, fields)
+
+
+# Worker entry point, returns the parsed task together with how long it took
+def _timed_parse_task(file_path, member, start, end, encoding, fields):
+    start_time = time.perf_counter()
+    runs, bad_lines, line_count = _parse_task(file_path, member, start, end, encoding, fields)
+    return runs, bad_lines, line_count, time.perf_counter() - start_time
+
+
+# Stitches the parsed ranges of one shard back together, line numbers are reported as in a sequential read
+def _merge_ranges(source_name, range_results):
     sub_list = []
+    skipped = 0
+    elapsed = 0.0
+    line_offset = 0
 
-    # Open and read the file line by line
-    with open(file_path, 'r', encoding=encoding, errors='replace') as file:
-        for index, line in enumerate(file):
-            try:
-                # Parse each line as JSON and convert it into a dictionary
-                run = json.loads(line)
-                event = run['event']
-                event['host'] = run.get('host', '')
-                event['time'] = run.get('time', '')
-                sub_list.append(event)
-            except json.JSONDecodeError:
-                print(f"{index} line in {file_path} is not valid JSON. Skipped it.")
-                pass
-
-    # Store the sub_list in the sublists_dict using the relative path as the key
-    data[relative_path] = sub_list
-    return data
+    for runs, bad_lines, line_count, range_time in range_results:
+        for index in bad_lines:
+            print(f"{line_offset + index} line in {source_name} is not valid JSON. Skipped it.")
+        sub_list.extend(runs)
+        skipped += len(bad_lines)
+        elapsed += range_time
+        line_offset += line_count
+
+    return sub_list, skipped, elapsed
+
+
+# Parsed tasks in the order of the tasks. With workers only a few tasks per worker are in flight, so parsed runs that
+# weren't consumed yet don't pile up in memory.
+def _parse_tasks(tasks, encoding, workers, fields=None):
+    if workers > 1 and len(tasks) > 1:
+        workers = min(workers, len(tasks))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            remaining = iter(tasks)
+            pending = deque(executor.submit(_timed_parse_task, *task, encoding, fields)
+                            for task in islice(remaining, 2 * workers))
+            while pending:
+                result = pending.popleft().result()
+                for task in islice(remaining, 1):
+                    pending.append(executor.submit(_timed_parse_task, *task, encoding, fields))
+                yield result
+    else:
+        for task in tasks:
+            yield _timed_parse_task(*task, encoding, fields)
+
+
+def _strip_compression(relative_path):
+    root, extension = os.path.splitext(relative_path)
+    return root if extension.lower() in COMPRESSED_OPENERS else relative_path
+
+
+# The shards in a metrics file as (key, zip member) pairs. Compressed files are keyed without their extension and
+# every file in a zip archive is its own shard, keyed by its path in the archive (relative to the archive's folder).
+def file_shards(directory, file_path):
+    relative_path = _relative_key(directory, file_path)
+    if not zipfile.is_zipfile(file_path):
+        return [(_strip_compression(relative_path), None)]
+
+    folder = os.path.dirname(relative_path)
+    with zipfile.ZipFile(file_path) as archive:
+        members = sorted(info.filename for info in archive.infolist() if not info.is_dir())
+    return [('/'.join(filter(None, [folder, _strip_compression(member)])), member) for member in members]
+
+
+# The shards of every file (see file_shards), raises if two sources end up with the same key (e.g. 2024/01/01 next to
+# 2024/01/01.gz) since one would replace the runs of the other
+def files_shards(directory, file_paths) -> dict:
+    shards = {}
+    sources = {}
+    for file_path in file_paths:
+        shards[file_path] = file_shards(directory, file_path)
+        for key, member in shards[file_path]:
+            source_name = f"{file_path}:{member}" if member is not None else file_path
+            if key in sources:
+                raise ValueError(f"{sources[key]} and {source_name} both hold the runs of {key}, remove one of them.")
+            sources[key] = source_name
+    return shards
+
+
+# Splits a metrics file into parse tasks, only plain files can be split into byte ranges
+def _shard_tasks(file_path, member, chunk_size):
+    if member is not None or os.path.splitext(file_path)[1].lower() in COMPRESSED_OPENERS:
+        return [(file_path, member, None, None)]
+    return [(file_path, None, start, end) for start, end in split_file(file_path, chunk_size)]
+
+
+# Parses the given files and yields (key, runs) for every shard as soon as it's parsed, in file order. workers > 1
+# spreads the files (and ranges of large files) over a process pool. Compressed files and zip archives are decompressed
+# by the workers.
+def iterate_parsed_shards(directory, file_paths, encoding='utf-8', workers=1, chunk_size=CHUNK_SIZE, fields=None):
+    start = time.perf_counter()
+
+    tasks = []
+    shards = []
+    for file_path, file_path_shards in files_shards(directory, file_paths).items():
+        for key, member in file_path_shards:
+            shard_tasks = _shard_tasks(file_path, member, chunk_size)
+            source_name = f"{file_path}:{member}" if member is not None else file_path
+            shards.append((key, source_name, len(shard_tasks)))
+            tasks.extend(shard_tasks)
+
+    results = _parse_tasks(tasks, encoding, workers, fields)
+
+    total_skipped = 0
+    for key, source_name, task_count in shards:
+        sub_list, skipped, elapsed = _merge_ranges(source_name, islice(results, task_count))
+        print(f"Parsed {key}: {len(sub_list)} runs, {skipped} skipped lines in {elapsed:.2f}s")
+        total_skipped += skipped
+        yield key, sub_list
+
+    print(f"Parsed {len(file_paths)} files with {workers} worker(s) in {time.perf_counter() - start:.2f}s, "
+          f"{total_skipped} lines skipped in total")
+
+
+# Same as iterate_parsed_shards, but returns all runs at once keyed by shard
+def parse_files(directory, file_paths, encoding='utf-8', workers=1, chunk_size=CHUNK_SIZE, fields=None):
+    return dict(iterate_parsed_shards(directory, file_paths, encoding, workers, chunk_size, fields))
 
 
-def iterate_directory(directory, encoding='utf-8'):
+# workers > 1 parses large files in parallel byte ranges, the result is the same as reading it line by line.
+# Returns the runs of every shard in the file keyed by the shard's key (see file_shards).
+def process_file(directory, file_path, encoding='utf-8', workers=1, chunk_size=CHUNK_SIZE, fields=None):
     data = {}
+    for key, member in file_shards(directory, file_path):
+        source_name = f"{file_path}:{member}" if member is not None else file_path
+        tasks = _shard_tasks(file_path, member, chunk_size)
+        data[key], _, _ = _merge_ranges(source_name, _parse_tasks(tasks, encoding, workers, fields))
+    return data
+
+
+def list_metric_files(directory):
+    file_paths = []
     for root, _, files in os.walk(directory):
         for file in files:
-            file_path = os.path.join(root, file)
-            data.update(process_file(directory, file_path, encoding))
+            file_paths.append(os.path.join(root, file))
+    # Sort so the merged result doesn't depend on the file system or worker scheduling
+    return sorted(file_paths, key=lambda path: _relative_key(directory, path))
 
-    return data
+
+def iterate_directory(directory, encoding='utf-8', workers=1, chunk_size=CHUNK_SIZE, fields=None):
+    return parse_files(directory, list_metric_files(directory), encoding, workers, chunk_size, fields)
+
+
+def hash_file(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _manifest_entry(file_path, stat=None):
+    stat = stat or os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": hash_file(file_path)}
+
+
+# The loader projects runs onto the requested fields plus the ones it always keeps, None keeps everything
+def projected_fields(fields):
+    if fields is None:
+        return None
+    return frozenset(fields) | BASE_FIELDS
 
 
 def save_data_to_json(filename, data):
@@ -61,19 +310,98 @@ def load_data_from_pickle(filename):
         return data
 
 
-# Takes in a dict with keys consisting of YYYY/MM/DD and merges lists based on the input level (2 = YYYY/MM)
-def round_date_keys(input_dict, level):
+# Re-iterable source of runs that yields them shard by shard, only one shard needs to be in memory at a time.
+# Any insight can be given a source in place of a list of runs.
+class RunSource:
+    def shards(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        for shard in self.shards():
+            yield from shard
+            # Let stores drop whatever they loaded for this pass
+            if isinstance(shard, RunStore):
+                shard.release()
+
+
+# Lazily chains several run sequences (lists or RunStores) into one without copying them
+class RunView(RunSource):
+    def __init__(self, segments=()):
+        self.segments = list(segments)
+
+    def shards(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        for segment in self.segments:
+            if 0 <= index < len(segment):
+                return segment[index]
+            index -= len(segment)
+        raise IndexError("RunView index out of range")
+
+
+# Streams the runs straight from the metric files, one file is parsed per shard
+class MetricsSource(RunSource):
+    def __init__(self, directory, encoding='utf-8', fields=None):
+        self.directory = directory
+        self.encoding = encoding
+        self.fields = projected_fields(fields)
+
+    def shards(self):
+        for file_path in list_metric_files(self.directory):
+            yield from process_file(self.directory, file_path, self.encoding, fields=self.fields).values()
+
+
+def _rounded_key(date_key, level):
+    return '/'.join(date_key.split('/')[:level])
+
+
+# Takes in a dict with keys consisting of YYYY/MM/DD and groups the lists based on the input level (2 = YYYY/MM).
+# The groups are views over the original lists, nothing gets copied.
+def round_date_keys(input_dict, level) -> dict:
     if level < 0:
         raise ValueError("Level must be a non-negative integer.")
 
-    merged_dict = defaultdict(list)
-
+    grouped = {}
     for date_key, data_list in input_dict.items():
-        date_parts = date_key.split('/')
-        rounded_key = '/'.join(date_parts[:level])
-        merged_dict[rounded_key].extend(data_list)
+        grouped.setdefault(_rounded_key(date_key, level), RunView()).segments.append(data_list)
 
-    return merged_dict
+    return grouped
+
+
+# Date of a YYYY/MM/DD partition key (file extensions are ignored), None if the key isn't a date
+def partition_date(date_key):
+    parts = date_key.split('/')
+    try:
+        return datetime.date(int(parts[0]), int(parts[1]), int(parts[2].split('.')[0]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _as_date(value):
+    if value is None or isinstance(value, datetime.date):
+        return value
+    return partition_date(value)
+
+
+# Keys of the partitions between start and end (inclusive), both can be dates or YYYY/MM/DD strings and are optional
+def keys_in_range(keys, start=None, end=None) -> list:
+    start, end = _as_date(start), _as_date(end)
+    if start is None and end is None:
+        return list(keys)
+
+    selected = []
+    for key in keys:
+        date = partition_date(key)
+        if date is None or (start is not None and date < start) or (end is not None and date > end):
+            continue
+        selected.append(key)
+    return selected
 
 
 def mega_list_merge(input_dict):
@@ -90,3 +418,739 @@ def reverse_and_flatten_dict(input_dict):
         for value in values:
             new_dict[value] = key
     return new_dict
+
+
+# Maps strings to dense integer ids and back
+class Interner:
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = {value: index for index, value in enumerate(self.values)}
+
+    def intern(self, value: str) -> int:
+        index = self.ids.get(value)
+        if index is None:
+            index = len(self.values)
+            self.ids[value] = index
+            self.values.append(value)
+        return index
+
+    def get(self, value: str, default: int = -1) -> int:
+        return self.ids.get(value, default)
+
+    def __getitem__(self, index: int) -> str:
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Scalar run fields stored as typed columns: field -> (dtype, interner or None, expected python type)
+RUN_SCALARS = {
+    "victory": (np.int8, None, bool),
+    "ascension_level": (np.int16, None, int),
+    "host": (np.int32, "hosts", str),
+    "time": (np.int64, None, int),
+    "pickedHat": (np.int32, "hats", str),
+    "enabledExpansionPacks": (np.int8, None, bool),
+}
+
+# List run fields stored as flat id arrays with offsets: field -> (interner, separator for comma joined strings)
+RUN_LISTS = {
+    "currentPacks": ("packs", ","),
+    "filteredPacks": ("packs", ","),
+    "master_deck": ("cards", None),
+}
+
+# Integer list run fields stored as flat value arrays with offsets like RUN_LISTS: field -> dtype.
+# Lists with values that don't fit the dtype stay in the extras.
+RUN_INT_LISTS = {
+    "current_hp_per_floor": np.int16,
+    "max_hp_per_floor": np.int16,
+}
+
+# Bit of every columnar field in the present column, fields with an unexpected type fall back to the extras
+_FIELD_BITS = {field: 1 << index for index, field in enumerate([*RUN_SCALARS, *RUN_LISTS, *RUN_INT_LISTS])}
+
+
+def _fits(values, dtype) -> bool:
+    limits = np.iinfo(dtype)
+    return all(type(value) is int and limits.min <= value <= limits.max for value in values)
+
+# Derived run features (see features.py) are stored the same way: feature -> interner (None for plain ints)
+FEATURE_LISTS = {
+    "packs": "packs",
+    "deck": "cards",
+    "smith_targets": "cards",
+    "rest_floors": None,
+    "gem_types": "gems",
+}
+FEATURE_SCALARS = {
+    "gem_count": np.int32,
+    "has_card_modifiers": np.int8,
+    "gems_pack": np.int8,
+}
+
+
+# Turns a sequence of RunFeatures into columns, strings are interned into the store interners
+def feature_columns(features, interners) -> dict:
+    list_values = {name: [] for name in FEATURE_LISTS}
+    list_offsets = {name: [0] for name in FEATURE_LISTS}
+    scalars = {name: [] for name in FEATURE_SCALARS}
+
+    for run_features in features:
+        for name, interner in FEATURE_LISTS.items():
+            items = getattr(run_features, name)
+            if interner is not None:
+                intern = interners[interner].intern
+                items = [intern(item) for item in items]
+            list_values[name].extend(items)
+            list_offsets[name].append(len(list_values[name]))
+        for name in FEATURE_SCALARS:
+            scalars[name].append(getattr(run_features, name))
+
+    columns = {}
+    for name in FEATURE_LISTS:
+        columns[f"{name}.offsets"] = np.array(list_offsets[name], dtype=np.int64)
+        columns[f"{name}.values"] = np.array(list_values[name], dtype=np.int32)
+    for name, dtype in FEATURE_SCALARS.items():
+        columns[name] = np.array(scalars[name], dtype=dtype)
+    return columns
+
+
+# Columnar storage for runs. Scalars live in typed numpy arrays, strings are interned to integer ids and list fields
+# are flattened into one value array with offsets, so the values of run i are values[offsets[i]:offsets[i + 1]].
+# Fields without a column stay in a plain dict per run (extras) until the insights reading them are ported.
+# Indexing or iterating a store yields run dicts, so it can be passed to any insight in place of a list of runs.
+class RunStore:
+    # extras can also be a callable returning the list, it's then only loaded on first access.
+    # features are the columns made by feature_columns, None if the features weren't derived for this store.
+    # events are the event tables of the runs (see events.py) by name, None if they weren't derived.
+    def __init__(self, columns, extras, interners, features=None, events=None):
+        self.columns = columns
+        self.interners = interners
+        self.features = features
+        self.events = events
+        self._load_extras = extras if callable(extras) else None
+        self._extras = None if callable(extras) else extras
+        self._index = None
+
+    @property
+    def extras(self):
+        if self._extras is None:
+            self._extras = self._load_extras()
+        return self._extras
+
+    # Bitmap indexes over the runs of the store (see bitmaps.RunIndex), they stay around until the store is dropped
+    @property
+    def index(self) -> RunIndex:
+        if self._index is None:
+            self._index = RunIndex(self)
+        return self._index
+
+    # Drops lazily loaded extras again, they get reloaded on the next access
+    def release(self):
+        if self._load_extras is not None:
+            self._extras = None
+
+    @staticmethod
+    def new_interners():
+        return {"packs": Interner(), "cards": Interner(), "hats": Interner(), "hosts": Interner(), "enemies": Interner(),
+                "gems": Interner()}
+
+    @classmethod
+    def from_runs(cls, runs, interners=None):
+        interners = interners if interners is not None else cls.new_interners()
+        scalars = {field: [] for field in RUN_SCALARS}
+        list_values = {field: [] for field in [*RUN_LISTS, *RUN_INT_LISTS]}
+        list_offsets = {field: [0] for field in [*RUN_LISTS, *RUN_INT_LISTS]}
+        present = []
+        extras = []
+
+        for run in runs:
+            bits = 0
+            extra = {}
+
+            for field, value in run.items():
+                if field == FEATURES_KEY:
+                    continue
+                if field in RUN_SCALARS:
+                    _, interner, value_type = RUN_SCALARS[field]
+                    if type(value) is value_type:
+                        bits |= _FIELD_BITS[field]
+                        continue
+                elif field in RUN_LISTS:
+                    interner, separator = RUN_LISTS[field]
+                    if separator is not None and type(value) is str:
+                        bits |= _FIELD_BITS[field]
+                        continue
+                    if separator is None and type(value) is list and all(type(item) is str for item in value):
+                        bits |= _FIELD_BITS[field]
+                        continue
+                elif field in RUN_INT_LISTS:
+                    if type(value) is list and _fits(value, RUN_INT_LISTS[field]):
+                        bits |= _FIELD_BITS[field]
+                        continue
+                extra[field] = value
+
+            for field, (_, interner, _) in RUN_SCALARS.items():
+                if bits & _FIELD_BITS[field]:
+                    value = run[field]
+                    scalars[field].append(interners[interner].intern(value) if interner else value)
+                else:
+                    scalars[field].append(0)
+
+            for field, (interner, separator) in RUN_LISTS.items():
+                if bits & _FIELD_BITS[field]:
+                    items = run[field].split(separator) if separator is not None else run[field]
+                    # "".split(",") gives [""], an empty string is stored as no items
+                    if separator is not None and items == [""]:
+                        items = []
+                    intern = interners[interner].intern
+                    list_values[field].extend(intern(item) for item in items)
+                list_offsets[field].append(len(list_values[field]))
+
+            for field in RUN_INT_LISTS:
+                if bits & _FIELD_BITS[field]:
+                    list_values[field].extend(run[field])
+                list_offsets[field].append(len(list_values[field]))
+
+            present.append(bits)
+            extras.append(extra)
+
+        columns = {"present": np.array(present, dtype=np.uint16)}
+        for field, (dtype, _, _) in RUN_SCALARS.items():
+            columns[field] = np.array(scalars[field], dtype=dtype)
+        for field in RUN_LISTS:
+            columns[f"{field}.offsets"] = np.array(list_offsets[field], dtype=np.int64)
+            columns[f"{field}.values"] = np.array(list_values[field], dtype=np.int32)
+        for field, dtype in RUN_INT_LISTS.items():
+            columns[f"{field}.offsets"] = np.array(list_offsets[field], dtype=np.int64)
+            columns[f"{field}.values"] = np.array(list_values[field], dtype=dtype)
+
+        return cls(columns, extras, interners)
+
+    # Store of the runs at the given (ascending) positions, with their features and events. The interners are shared,
+    # the extras are only picked out of this store's extras when they're read.
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        features = _take_columns(self.features, indices) if self.features is not None else None
+        events = None
+        if self.events is not None:
+            # Events point at the run positions in this store, they're renumbered to the positions in the new one
+            positions = np.full(len(self), -1, dtype=np.int64)
+            positions[indices] = np.arange(len(indices))
+            events = {}
+            for name, table in self.events.items():
+                runs = positions[np.asarray(table["run"], dtype=np.int64)]
+                kept = runs >= 0
+                events[name] = {column: np.asarray(values)[kept] for column, values in table.items()}
+                events[name]["run"] = runs[kept].astype(np.asarray(table["run"]).dtype)
+        extras = lambda: [self.extras[index] for index in indices.tolist()]
+        return RunStore(_take_columns(self.columns, indices), extras, self.interners, features, events)
+
+    # function({field: value}) for every run, called once per distinct value of the field's column. Runs that have the
+    # field in their extras get the whole run, runs without it an empty dict.
+    def map_field(self, field, function) -> list:
+        _, interner, value_type = RUN_SCALARS[field]
+        names = self.interners[interner].values if interner else None
+        values, inverse = np.unique(np.asarray(self.columns[field]), return_inverse=True)
+        mapped = [function({field: names[value] if names is not None else value_type(value)}) for value in values.tolist()]
+        results = [mapped[position] for position in inverse.ravel().tolist()]
+
+        missing = function({})
+        for index in np.flatnonzero(~self.field_mask(field)).tolist():
+            results[index] = function(self[index]) if field in self.extras[index] else missing
+        return results
+
+    # Boolean array of the runs that have the field in its column
+    def field_mask(self, field):
+        return (self.columns["present"] & _FIELD_BITS[field]) != 0
+
+    # Ids (or values of an integer list) of a list field for a single run
+    def list_ids(self, field, index):
+        offsets = self.columns[f"{field}.offsets"]
+        return self.columns[f"{field}.values"][offsets[index]:offsets[index + 1]]
+
+    # Rebuilds the run dict at index, this is the adapter that lets list based insights read the store
+    def run(self, index) -> dict:
+        bits = int(self.columns["present"][index])
+        run = {}
+
+        for field, (_, interner, value_type) in RUN_SCALARS.items():
+            if bits & _FIELD_BITS[field]:
+                value = self.columns[field][index]
+                run[field] = self.interners[interner][value] if interner else value_type(value)
+
+        for field, (interner, separator) in RUN_LISTS.items():
+            if bits & _FIELD_BITS[field]:
+                names = self.interners[interner].values
+                items = [names[item] for item in self.list_ids(field, index).tolist()]
+                run[field] = separator.join(items) if separator is not None else items
+
+        for field in RUN_INT_LISTS:
+            if bits & _FIELD_BITS[field]:
+                run[field] = self.list_ids(field, index).tolist()
+
+        run.update(self.extras[index])
+        if self.features is not None:
+            run[FEATURES_KEY] = self.run_features(index)
+        return run
+
+    # Derived features of the run at index
+    def run_features(self, index) -> RunFeatures:
+        values = []
+        for name, interner in FEATURE_LISTS.items():
+            offsets = self.features[f"{name}.offsets"]
+            items = self.features[f"{name}.values"][offsets[index]:offsets[index + 1]].tolist()
+            if interner is not None:
+                names = self.interners[interner].values
+                items = [names[item] for item in items]
+            values.append(tuple(items))
+        for name, dtype in FEATURE_SCALARS.items():
+            values.append(bool(self.features[name][index]) if dtype is np.int8 else int(self.features[name][index]))
+        return RunFeatures(*values)
+
+    def __len__(self):
+        return len(self.columns["present"])
+
+    def __getitem__(self, index) -> dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RunStore index out of range")
+        return self.run(index)
+
+    def __iter__(self):
+        # Reading numpy (or memory mapped) scalars one by one is slow, so the columns are turned into python lists
+        # once and the runs are rebuilt from those
+        present = self.columns["present"].tolist()
+        scalars = []
+        for field, (_, interner, value_type) in RUN_SCALARS.items():
+            names = self.interners[interner].values if interner else None
+            scalars.append((field, _FIELD_BITS[field], self.columns[field].tolist(), names, value_type))
+        lists = []
+        for field, (interner, separator) in RUN_LISTS.items():
+            lists.append((field, _FIELD_BITS[field], self.columns[f"{field}.offsets"].tolist(),
+                          self.columns[f"{field}.values"].tolist(), self.interners[interner].values, separator))
+        int_lists = []
+        for field in RUN_INT_LISTS:
+            int_lists.append((field, _FIELD_BITS[field], self.columns[f"{field}.offsets"].tolist(),
+                              self.columns[f"{field}.values"].tolist()))
+        extras = self.extras
+        features = self._iter_features() if self.features is not None else None
+
+        for index, bits in enumerate(present):
+            run = {}
+            for field, bit, values, names, value_type in scalars:
+                if bits & bit:
+                    run[field] = names[values[index]] if names is not None else value_type(values[index])
+            for field, bit, offsets, values, names, separator in lists:
+                if bits & bit:
+                    items = [names[item] for item in values[offsets[index]:offsets[index + 1]]]
+                    run[field] = separator.join(items) if separator is not None else items
+            for field, bit, offsets, values in int_lists:
+                if bits & bit:
+                    run[field] = values[offsets[index]:offsets[index + 1]]
+            run.update(extras[index])
+            if features is not None:
+                run[FEATURES_KEY] = next(features)
+            yield run
+
+    def _iter_features(self):
+        lists = []
+        for name, interner in FEATURE_LISTS.items():
+            names = self.interners[interner].values if interner is not None else None
+            lists.append((self.features[f"{name}.offsets"].tolist(), self.features[f"{name}.values"].tolist(), names))
+        # int8 features are flags
+        scalars = [(self.features[name].tolist(), bool if dtype is np.int8 else int)
+                   for name, dtype in FEATURE_SCALARS.items()]
+
+        for index in range(len(self)):
+            values = []
+            for offsets, items, names in lists:
+                items = items[offsets[index]:offsets[index + 1]]
+                values.append(tuple(names[item] for item in items) if names is not None else tuple(items))
+            for column, value_type in scalars:
+                values.append(value_type(column[index]))
+            yield RunFeatures(*values)
+
+
+# Rows of the columns at the given positions, list fields (name.offsets with name.values) get new offsets
+def _take_columns(columns, indices) -> dict:
+    taken = {}
+    for name, column in columns.items():
+        if name.endswith(".values"):
+            continue
+        if name.endswith(".offsets"):
+            field = name[:-len(".offsets")]
+            offsets = np.asarray(column, dtype=np.int64)
+            lengths = np.diff(offsets)[indices]
+            new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+            positions = np.repeat(offsets[indices] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+            taken[name] = new_offsets
+            taken[f"{field}.values"] = np.asarray(columns[f"{field}.values"])[positions]
+        else:
+            taken[name] = np.asarray(column)[indices]
+    return taken
+
+
+# Version of the binary cache layout, caches written with another version are rebuilt
+CACHE_VERSION = 2
+
+
+# Writes every column of the store to its own raw .bin file next to a header with the schema version, the dtypes,
+# the lengths and a crc32 over all column bytes. Fields without a column are pickled to extras.pkl.
+def save_store(store, directory):
+    columns, checksum = _write_columns(store.columns, directory)
+    save_data_to_pickle(os.path.join(directory, "extras.pkl"), store.extras)
+    # The header is written last, a directory without one is treated as missing
+    save_data_to_json(os.path.join(directory, "header.json"),
+                      {"version": CACHE_VERSION, "runs": len(store), "columns": columns, "checksum": checksum})
+
+
+def _write_columns(columns, directory):
+    os.makedirs(directory, exist_ok=True)
+    checksum = 0
+    schema = {}
+
+    for name, array in columns.items():
+        array = np.ascontiguousarray(array)
+        with open(os.path.join(directory, f"{name}.bin"), 'wb') as file:
+            file.write(array.tobytes())
+        checksum = zlib.crc32(array.tobytes(), checksum)
+        schema[name] = {"dtype": array.dtype.str, "length": len(array)}
+
+    return schema, checksum
+
+
+def _map_column(path, dtype, length):
+    # Empty files can't be memory mapped
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+
+def _read_columns(directory, header, verify):
+    columns = {}
+    checksum = 0
+    for name, column in header["columns"].items():
+        columns[name] = _map_column(os.path.join(directory, f"{name}.bin"), np.dtype(column["dtype"]), column["length"])
+        if verify:
+            checksum = zlib.crc32(columns[name].tobytes(), checksum)
+
+    if verify and checksum != header["checksum"]:
+        raise ValueError(f"Checksum mismatch in {directory}, the cache is corrupted.")
+    return columns
+
+
+# Memory maps the columns written by save_store, nothing is copied or parsed until a column is read.
+# verify recomputes the checksum, which reads every column once.
+def load_store(directory, interners, verify=False):
+    header = load_data_from_json(os.path.join(directory, "header.json"))
+    if header["version"] != CACHE_VERSION:
+        raise ValueError(f"{directory} has cache version {header['version']}, expected {CACHE_VERSION}.")
+
+    columns = _read_columns(directory, header, verify)
+    extras_path = os.path.join(directory, "extras.pkl")
+    return RunStore(columns, lambda: load_data_from_pickle(extras_path), interners)
+
+
+# Writes the feature columns of a partition like save_store writes the run columns
+def save_features(columns, directory):
+    schema, checksum = _write_columns(columns, directory)
+    save_data_to_json(os.path.join(directory, "header.json"),
+                      {"version": FEATURES_VERSION, "columns": schema, "checksum": checksum})
+
+
+# Memory maps the feature columns, None if they're missing or were derived by another version
+def load_features(directory, verify=False):
+    header_path = os.path.join(directory, "header.json")
+    if not os.path.exists(header_path):
+        return None
+    header = load_data_from_json(header_path)
+    if header["version"] != FEATURES_VERSION:
+        return None
+    return _read_columns(directory, header, verify)
+
+
+# Writes every event table to its own directory, the header records the version of the table's derivation
+def save_events(tables, directory):
+    for name, columns in tables.items():
+        table_dir = os.path.join(directory, name)
+        schema, checksum = _write_columns(columns, table_dir)
+        save_data_to_json(os.path.join(table_dir, "header.json"),
+                          {"version": EVENT_TABLES[name][0], "columns": schema, "checksum": checksum})
+
+
+# Memory maps the event tables, tables that are missing or were derived by another version are left out
+def load_events(directory, verify=False) -> dict:
+    tables = {}
+    for name, (version, _) in EVENT_TABLES.items():
+        header_path = os.path.join(directory, name, "header.json")
+        if os.path.exists(header_path):
+            header = load_data_from_json(header_path)
+            if header["version"] == version:
+                tables[name] = _read_columns(os.path.join(directory, name), header, verify)
+    return tables
+
+
+# On disk cache of the parsed metrics. Every metrics file becomes a partition directory holding a saved RunStore,
+# all partitions share the interned strings in strings.json and manifest.json records which files were ingested.
+# The derived features of every partition are kept in a features directory inside the partition, its event tables in
+# an events directory and saved partial insight states (see engine.run_cached_insights) in a partials directory.
+# Checksums: a partition is verified the first time it's opened after it was written (the manifest lists the
+# partitions that weren't yet), which catches a write that was cut off or corrupted without reading every column on
+# every start. verify=True checks every partition on every open.
+class RunCache:
+    def __init__(self, cache_dir, manifest, interners, verify=False):
+        self.cache_dir = cache_dir
+        self.manifest = manifest
+        self.interners = interners
+        self.verify = verify
+        self._stores = {}
+
+    @classmethod
+    def open(cls, cache_dir, verify=False):
+        manifest = {"version": CACHE_VERSION, "fields": None, "files": {}, "partitions": [], "unverified": []}
+        interners = RunStore.new_interners()
+
+        manifest_path = os.path.join(cache_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            stored = load_data_from_json(manifest_path)
+            if stored.get("version") == CACHE_VERSION:
+                manifest = stored
+                strings = load_data_from_json(os.path.join(cache_dir, "strings.json"))
+                # Interners added since the cache was written start out empty
+                interners.update((name, Interner(values)) for name, values in strings.items())
+            else:
+                print(f"The cache in {cache_dir} has an old version, rebuilding it.")
+                shutil.rmtree(os.path.join(cache_dir, "runs"), ignore_errors=True)
+
+        return cls(cache_dir, manifest, interners, verify)
+
+    def _partition_dir(self, key):
+        return os.path.join(self.cache_dir, "runs", *key.split('/'))
+
+    def keys(self):
+        return list(self.manifest["partitions"])
+
+    def partition(self, key) -> RunStore:
+        if key not in self._stores:
+            directory = self._partition_dir(key)
+            unverified = self.manifest.get("unverified", [])
+            verify = self.verify or key in unverified
+            store = load_store(directory, self.interners, verify)
+            store.features = load_features(os.path.join(directory, "features"), verify)
+            if store.features is None:
+                # Partitions written before the features existed (or with an older derivation) are derived once
+                store.features = feature_columns((derive_features(run) for run in store), self.interners)
+                store.release()
+                # The features can intern new strings, those have to be saved before the features reference them
+                self.save()
+                save_features(store.features, os.path.join(directory, "features"))
+                # Partials were computed from the old features
+                shutil.rmtree(os.path.join(directory, "partials"), ignore_errors=True)
+
+            store.events = load_events(os.path.join(directory, "events"), verify)
+            missing = [name for name in EVENT_TABLES if name not in store.events]
+            if missing:
+                # Same for event tables that are new or were derived by an older version
+                tables = derive_events(store, self.interners, missing)
+                store.release()
+                self.save()
+                save_events(tables, os.path.join(directory, "events"))
+                store.events.update(tables)
+                shutil.rmtree(os.path.join(directory, "partials"), ignore_errors=True)
+            if key in unverified:
+                unverified.remove(key)
+                self.save()
+            self._stores[key] = store
+        return self._stores[key]
+
+    # Partition key -> RunStore, a drop in replacement for the date_to_metrics dict
+    @property
+    def partitions(self) -> dict:
+        return {key: self.partition(key) for key in self.keys()}
+
+    # All runs of the partitions between start and end (inclusive) as one view, see keys_in_range.
+    # Only the selected partitions get opened.
+    def select(self, start=None, end=None) -> RunView:
+        return RunView(self.partition(key) for key in keys_in_range(self.keys(), start, end))
+
+    # Views of the selected partitions grouped by their key rounded to the level (1 = YYYY, 2 = YYYY/MM, 0 = all)
+    def group(self, level, start=None, end=None) -> dict:
+        if level < 0:
+            raise ValueError("Level must be a non-negative integer.")
+
+        grouped = {}
+        for key in keys_in_range(self.keys(), start, end):
+            grouped.setdefault(_rounded_key(key, level), RunView()).segments.append(self.partition(key))
+        return grouped
+
+    # Runs of the last days up to and including today (defaults to the current date)
+    def last_days(self, days, today=None) -> RunView:
+        today = _as_date(today) or datetime.date.today()
+        return self.select(today - datetime.timedelta(days=days - 1), today)
+
+    # Number of runs between start and end that match the conditions of RunIndex.select,
+    # e.g. cache.count(pack="anniv5:GemsPack", ascension=20, victory=True)
+    def count(self, start=None, end=None, **conditions) -> int:
+        return sum(self.partition(key).index.count(**conditions) for key in keys_in_range(self.keys(), start, end))
+
+    def _partial_path(self, key, name):
+        return os.path.join(self._partition_dir(key), "partials", f"{name}.pkl")
+
+    # Saved partial state of an accumulator for the partition, None if there is none
+    def load_partial(self, key, name):
+        path = self._partial_path(key, name)
+        if not os.path.exists(path):
+            return None
+        return load_data_from_pickle(path)
+
+    # Saves the partial state, partials of the same accumulator with another name (an older version) are removed
+    def save_partial(self, key, name, state):
+        path = self._partial_path(key, name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        prefix = name.split('.')[0] + '.'
+        for file_name in os.listdir(directory):
+            if file_name.startswith(prefix) and file_name != f"{name}.pkl":
+                os.remove(os.path.join(directory, file_name))
+
+        # Written to a temporary file first so an interrupted save doesn't leave a broken partial behind
+        save_data_to_pickle(path + ".tmp", state)
+        os.replace(path + ".tmp", path)
+
+    def write_partition(self, key, runs):
+        self.drop_partition(key)
+        directory = self._partition_dir(key)
+        save_store(RunStore.from_runs(runs, self.interners), directory)
+        save_features(feature_columns((derive_features(run) for run in runs), self.interners),
+                      os.path.join(directory, "features"))
+        save_events(derive_events(runs, self.interners), os.path.join(directory, "events"))
+        self.manifest["partitions"] = sorted(set(self.manifest["partitions"]) | {key})
+        self.manifest.setdefault("unverified", []).append(key)
+
+    def drop_partition(self, key):
+        self._stores.pop(key, None)
+        shutil.rmtree(self._partition_dir(key), ignore_errors=True)
+        self.manifest["partitions"] = [partition for partition in self.manifest["partitions"] if partition != key]
+        if key in self.manifest.get("unverified", []):
+            self.manifest["unverified"].remove(key)
+
+    def save(self):
+        # Strings go first, partitions only become visible once the manifest lists them
+        save_data_to_json(os.path.join(self.cache_dir, "strings.json"),
+                          {name: interner.values for name, interner in self.interners.items()})
+        save_data_to_json(os.path.join(self.cache_dir, "manifest.json"), self.manifest)
+
+    # Brings the cache in line with the metrics directory by only parsing new or changed files.
+    # Files are compared by size and mtime first, the content hash is only computed when those differ.
+    # fields are the run fields to keep (see insights.required_fields), None keeps whole runs.
+    # Returns whether anything changed.
+    def update(self, metrics_path, encoding='utf-8', workers=1, chunk_size=CHUNK_SIZE, fields=None):
+        fields = projected_fields(fields)
+        cached_fields = self.manifest["fields"]
+        files = self.manifest["files"]
+        partitions = set(self.keys())
+        changed = False
+
+        # A cache projected onto fewer fields than we need now has to be rebuilt
+        if partitions and cached_fields is not None and (fields is None or not fields <= set(cached_fields)):
+            print("The cache is missing fields the insights read, reparsing all metrics.")
+            for key in partitions:
+                self.drop_partition(key)
+            partitions.clear()
+            files.clear()
+            changed = True
+        if not partitions:
+            self.manifest["fields"] = sorted(fields) if fields is not None else None
+        # New files are projected like the ones already cached
+        fields = set(self.manifest["fields"]) if self.manifest["fields"] is not None else None
+
+        # Manifest entries are keyed by file, every entry lists the partitions the file produced (zip archives can
+        # hold several, other files hold exactly one)
+        current_files = set()
+        to_parse = []
+        # Checked up front, files that would overwrite each other's partitions stop the update before anything changes
+        shards = files_shards(metrics_path, list_metric_files(metrics_path))
+        for file_path, file_path_shards in shards.items():
+            file_key = _relative_key(metrics_path, file_path)
+            current_files.add(file_key)
+            stat = os.stat(file_path)
+            entry = files.get(file_key)
+            shard_keys = [key for key, _ in file_path_shards]
+
+            if entry is None:
+                if all(key in partitions for key in shard_keys):
+                    # Partitions converted from a pickle have no manifest entry yet, they're assumed to match the file
+                    files[file_key] = {**_manifest_entry(file_path, stat), "partitions": shard_keys}
+                    changed = True
+                    continue
+            else:
+                entry_partitions = entry.get("partitions", [file_key])
+                cached = all(key in partitions for key in entry_partitions)
+                if cached and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                    continue
+
+                new_entry = {**_manifest_entry(file_path, stat), "partitions": entry_partitions}
+                if cached and entry["hash"] == new_entry["hash"]:
+                    # Only touched, the cached runs are still valid
+                    files[file_key] = new_entry
+                    changed = True
+                    continue
+
+                # The file changed, whatever it produced before is replaced
+                for key in entry_partitions:
+                    self.drop_partition(key)
+                    partitions.discard(key)
+
+            files[file_key] = {**_manifest_entry(file_path, stat), "partitions": shard_keys}
+            to_parse.append(file_path)
+            changed = True
+
+        for file_key in list(files):
+            if file_key not in current_files:
+                print(f"Dropping {file_key}, it's no longer in the metrics directory.")
+                for key in files.pop(file_key).get("partitions", [file_key]):
+                    self.drop_partition(key)
+                    partitions.discard(key)
+                changed = True
+
+        # Partitions no file claims anymore (e.g. from a pickle with files that are gone)
+        claimed = {key for entry in files.values() for key in entry.get("partitions", [])}
+        for key in partitions - claimed:
+            print(f"Dropping {key}, it's no longer in the metrics directory.")
+            self.drop_partition(key)
+            changed = True
+
+        if to_parse:
+            # Every partition is written as soon as its shard is parsed, only a few shards are in memory at a time
+            for key, runs in iterate_parsed_shards(metrics_path, to_parse, encoding, workers, chunk_size, fields):
+                self.write_partition(key, runs)
+
+        if changed:
+            self.save()
+        return changed
+
+
+# Opens the cache and updates it with whatever changed in the metrics directory since it was saved
+def load_run_cache(cache_dir, metrics_path, encoding='utf-8', workers=1, fields=None, verify=False) -> RunCache:
+    cache = RunCache.open(cache_dir, verify)
+    cache.update(metrics_path, encoding, workers, fields=fields)
+    return cache
+
+
+# One-shot conversion of a data.pkl from before the binary cache, the manifest entries of its files are filled in
+# on the next update
+def convert_pickle_to_cache(pickle_path, cache_dir, fields=None):
+    data = load_data_from_pickle(pickle_path)
+    cache = RunCache.open(cache_dir)
+    cache.manifest["fields"] = sorted(projected_fields(fields)) if fields is not None else None
+
+    for key, runs in data.items():
+        cache.write_partition(key, runs)
+
+    cache.save()
+    return cache
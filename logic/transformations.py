@@ -1,3 +1,7 @@
+import hashlib
+import json
+from typing import NamedTuple
+
 removable_prefix: str = "anniv5:"
 
 
@@ -19,3 +23,109 @@ def add_pack_prefix(cardName: str, card_to_pack: dict, keep_upgrade: bool = True
 def make_ratio(positive: int, total: int) -> str:
     rate = (positive / total) * 100 if total > 0 else 0.0
     return f"{rate:.2f}"
+
+
+# Mods whose cards are tracked, other modded cards get no rarity (same rule as data_development.py)
+required_prefixes = {"anniv5", "clockworkchar", "oceanrodent", "bogwarden"}
+
+
+def is_tracked_card(cardName: str) -> bool:
+    return any(cardName.startswith(prefix + ":") for prefix in required_prefixes) or ":" not in cardName
+
+
+def split_upgrade(cardName: str) -> tuple[str, int]:
+    base, _, upgrade = cardName.partition('+')
+    if not upgrade:
+        return base, 0
+    return base, int(upgrade) if upgrade.isdigit() else 1
+
+
+class CardInfo(NamedTuple):
+    card_id: int  # Id of the card without its upgrade
+    pack_id: int  # -1 if the card isn't in any pack
+    rarity_id: int
+    upgrade: int
+    name: str  # Card name without upgrade and removable prefix
+    full_name: str  # Card name with upgrade but without removable prefix
+
+
+# Maps raw card strings (including upgrade suffixes like +1) to integer ids for the card, its pack and its rarity.
+# Lookups are memoized, so after the first time a card string is seen it costs a single dict lookup.
+class CardCatalog:
+    def __init__(self, card_to_pack: dict, card_to_rarity: dict):
+        self.packs = []
+        self.pack_ids = {}
+        self.rarities = ["Unknown"]
+        self.rarity_ids = {"Unknown": 0}
+        self.cards = []
+        self.card_ids = {}
+        self.card_pack = []
+        self.card_rarity = []
+        self._card_to_pack = card_to_pack
+        self._card_to_rarity = card_to_rarity
+        self._lookups = {}
+        # id(interner) -> (interner, card ids of its strings), see interned_card_ids
+        self._interned = {}
+        # Changes with the pack and rarity data, anything saved by card id is only valid for the same fingerprint
+        self.fingerprint = hashlib.sha1(json.dumps([card_to_pack, card_to_rarity], sort_keys=True).encode()).hexdigest()[:12]
+
+        for card in card_to_pack:
+            self._add_card(card)
+
+    def _intern_pack(self, pack: str) -> int:
+        if pack not in self.pack_ids:
+            self.pack_ids[pack] = len(self.packs)
+            self.packs.append(pack)
+        return self.pack_ids[pack]
+
+    def _intern_rarity(self, rarity: str) -> int:
+        if rarity not in self.rarity_ids:
+            self.rarity_ids[rarity] = len(self.rarities)
+            self.rarities.append(rarity)
+        return self.rarity_ids[rarity]
+
+    def _add_card(self, card: str) -> int:
+        card_id = self.card_ids.get(card)
+        if card_id is None:
+            card_id = len(self.cards)
+            self.card_ids[card] = card_id
+            self.cards.append(card)
+
+            pack = self._card_to_pack.get(card)
+            self.card_pack.append(self._intern_pack(pack) if pack else -1)
+            rarity = self._card_to_rarity.get(card, "Unknown") if is_tracked_card(card) else "Unknown"
+            self.card_rarity.append(self._intern_rarity(rarity))
+        return card_id
+
+    def lookup(self, cardName: str) -> CardInfo:
+        info = self._lookups.get(cardName)
+        if info is None:
+            base, upgrade = split_upgrade(cardName)
+            card_id = self._add_card(base)
+            info = CardInfo(card_id, self.card_pack[card_id], self.card_rarity[card_id], upgrade,
+                            del_prefix(base), del_prefix(cardName))
+            self._lookups[cardName] = info
+        return info
+
+    def card_id(self, cardName: str) -> int:
+        return self.lookup(cardName).card_id
+
+    def pack_of(self, card_id: int):
+        pack_id = self.card_pack[card_id]
+        return self.packs[pack_id] if pack_id >= 0 else None
+
+    def rarity_of(self, card_id: int) -> str:
+        return self.rarities[self.card_rarity[card_id]]
+
+    # Card ids of the strings of an Interner (in the order of its ids), extended when the interner has grown
+    def interned_card_ids(self, interner) -> list:
+        known = self._interned.get(id(interner))
+        if known is None or known[0] is not interner:
+            known = self._interned[id(interner)] = (interner, [])
+        ids = known[1]
+        ids.extend(self.card_id(value) for value in interner.values[len(ids):])
+        return ids
+
+    # Pack ids of the strings of an Interner, -1 for packs that aren't in the pack data
+    def interned_pack_ids(self, interner) -> list:
+        return [self.pack_ids.get(value, -1) for value in interner.values]
@@ -0,0 +1,31 @@
+from logic import insights
+from logic.engine import run_insights
+from logic.storage import RunStore
+
+# The first run lists pack a twice and the second one has an empty entry and lists b twice
+RUNS = [
+    {"victory": True, "ascension_level": 1, "currentPacks": "a,b,a"},
+    {"victory": False, "ascension_level": 2, "currentPacks": "b,,b,c"},
+    {"victory": True, "ascension_level": 20, "currentPacks": "c"},
+]
+
+
+def _rows(results):
+    return results[0]["Pack Win Rate"]["data"]
+
+
+def test_pack_counts_once_per_run():
+    rows = _rows(run_insights([dict(run) for run in RUNS], [insights.PackWinRate()]))
+    assert rows == [["a", 1, 1, "100.00"], ["b", 1, 2, "50.00"], ["c", 1, 2, "50.00"]]
+    assert _rows(run_insights(RunStore.from_runs([dict(run) for run in RUNS]), [insights.PackWinRate()])) == rows
+
+
+def test_cube_counts_once_per_run():
+    rows, shard = insights.PackAscensionCube(), insights.PackAscensionCube()
+    for run in RUNS:
+        rows.update(dict(run))
+    rows.flush()
+    shard.update_shard(RunStore.from_runs([dict(run) for run in RUNS]))
+    assert rows.packs == shard.packs == ["a", "b", "c"]
+    assert rows.pack_totals.sum(axis=1).tolist() == shard.pack_totals.sum(axis=1).tolist() == [1, 2, 2]
+    assert (rows.pack_wins == shard.pack_wins).all()
@@ -0,0 +1,36 @@
+from logic import insights
+from logic.engine import ascension_band, run_segmented_insights
+from logic.storage import RunStore, RunView
+
+
+def _run(ascension, victory, rest):
+    return {
+        "host": "host", "time": 1714521600, "ascension_level": ascension, "victory": victory,
+        "currentPacks": "anniv5:GemsPack,anniv5:FrostPack", "master_deck": ["Strike", "Defend"],
+        "current_hp_per_floor": [70, 60, 50], "max_hp_per_floor": [80, 80, 80],
+        "campfire_choices": [{"floor": 2, "key": "REST"}] if rest else [],
+    }
+
+
+# A1 has a win and a rest, A2 only a lost run without any rest, so its medians have nothing to work with
+RUNS = [_run(1, True, True), _run(1, False, True), _run(2, False, False)]
+
+
+def _segmented(runs):
+    return run_segmented_insights(runs, lambda: insights.all_insights({}, {}), ascension_band(1))
+
+
+def _sheet(results, name):
+    return next(result[name] for result in results if name in result)
+
+
+def test_segment_without_wins_or_rests():
+    results = _segmented(RUNS)
+    assert list(results) == ["A1", "A2"]
+    for name in ("Median Deck Sizes", "Health Before Rest"):
+        assert _sheet(results["A2"], name)["data"][0][:2] == ["Overall", "N/A"]
+        assert _sheet(results["A1"], name)["data"][0][1] != "N/A"
+
+
+def test_segments_of_a_store_match_the_runs():
+    assert _segmented(RunView([RunStore.from_runs(RUNS)])) == _segmented(RUNS)